@@ -1,8 +1,10 @@
 import os
+from datetime import datetime, timedelta
 
 import click
 from flask import Flask, render_template
 from flask_login import current_user
+from flask_migrate import stamp
 from flask_wtf.csrf import CSRFError
 
 from albumy.blueprints.admin import admin_bp
@@ -10,9 +12,16 @@ from albumy.blueprints.ajax import ajax_bp
 from albumy.blueprints.auth import auth_bp
 from albumy.blueprints.main import main_bp
 from albumy.blueprints.user import user_bp
-from albumy.extensions import bootstrap, db, login_manager, mail, dropzone, moment, whooshee, avatars, csrf
-from albumy.models import Role, User, Photo, Tag,Follow, Notification, Comment, Collect, Permission
+from albumy.cache import cache
+from albumy.emails import deliver_mail, close_connection, requeue_dead_letters
+from albumy.extensions import bootstrap, db, login_manager, mail, migrate, dropzone, moment, whooshee, avatars, csrf
+from albumy.models import Role, User, Photo, Tag,Follow, Notification, Comment, Collect, Permission, Timeline, ArchivedNotification, rebuild_counters
+from albumy.notifications import archive_notifications
+from albumy.profiling import profiler
+from albumy.search import search_index
 from albumy.settings import config
+from albumy.tags import clear_tag_rankings, tag_photos
+from albumy.timeline import rebuild_timeline
 
 def create_app(config_name=None):
 	if config_name is None:
@@ -32,6 +41,7 @@ def create_app(config_name=None):
 def register_extensions(app):
 	bootstrap.init_app(app)
 	db.init_app(app)
+	migrate.init_app(app, db, directory=os.path.join(os.path.dirname(app.root_path), 'migrations'), render_as_batch=True)
 	login_manager.init_app(app)
 	mail.init_app(app)
 	dropzone.init_app(app)
@@ -39,6 +49,9 @@ def register_extensions(app):
 	whooshee.init_app(app)
 	avatars.init_app(app)
 	csrf.init_app(app)
+	cache.init_app(app)
+	search_index.init_app(app)
+	profiler.init_app(app)
 
 def register_blueprints(app):
 	app.register_blueprint(main_bp)
@@ -50,13 +63,13 @@ def register_blueprints(app):
 def register_shell_context(app):
 	@app.shell_context_processor
 	def make_shell_context():
-		return dict(db=db, User=User, Role=Role, Photo=Photo, Tag=Tag, Follow=Follow, Collect=Collect, Comment=Comment, Notification=Notification, Permission=Permission)
+		return dict(db=db, User=User, Role=Role, Photo=Photo, Tag=Tag, Follow=Follow, Collect=Collect, Comment=Comment, Notification=Notification, Permission=Permission, Timeline=Timeline, ArchivedNotification=ArchivedNotification)
 
 def register_template_context(app):
 	@app.context_processor
 	def make_template_context():
 		if current_user.is_authenticated:
-			notification_count = Notification.query.with_parent(current_user).filter_by(is_read=False).count()
+			notification_count = current_user.unread_notifications_count
 		else:
 			notification_count = None
 		return dict(notification_count=notification_count)
@@ -95,18 +108,82 @@ def register_commands(app):
 			db.drop_all()
 			click.echo('Drop tables.')
 		db.create_all()
+		stamp()
 		click.echo('Initialized database')
 
 	@app.cli.command()
 	def init():
 		click.echo('Initializing the database...')
 		db.create_all()
+		stamp()
 
 		click.echo('Initializeing the roles and permissions...')
 		Role.init_role()
 
 		click.echo('Done.')
 
+	@app.cli.command()
+	def recount():
+		click.echo('Rebuilding the counters...')
+		rebuild_counters()
+		clear_tag_rankings()
+		click.echo('Done.')
+
+	@app.cli.command()
+	def timeline():
+		click.echo('Rebuilding the home timelines...')
+		rebuild_timeline()
+		click.echo('Done.')
+
+	@app.cli.command()
+	@click.option('--days', default=None, type=int, help='Archive read notifications older than this many days.')
+	def archive(days):
+		days = days or app.config['ALBUMY_NOTIFICATION_RETENTION_DAYS']
+		click.echo('Archiving read notifications older than %d days...' % days)
+		count = archive_notifications(datetime.utcnow() - timedelta(days=days))
+		click.echo('Archived %d notifications.' % count)
+		click.echo('Done.')
+
+	@app.cli.command()
+	def reindex():
+		click.echo('Rebuilding the search index...')
+		search_index.reindex()
+		click.echo('Done.')
+
+	@app.cli.command()
+	@click.option('--add', multiple=True, help='Tag name to attach, can be repeated.')
+	@click.option('--remove', multiple=True, help='Tag name to detach, can be repeated.')
+	@click.option('--photo', multiple=True, type=int, help='Photo id to edit, can be repeated.')
+	@click.option('--author', default=None, help='Edit every photo uploaded by this username.')
+	def tag(add, remove, photo, author):
+		if not photo and not author:
+			raise click.UsageError('Give at least one --photo or an --author.')
+		photos = Photo.query
+		if photo:
+			photos = photos.filter(Photo.id.in_(photo))
+		if author:
+			photos = photos.filter(Photo.author.has(username=author))
+		click.echo('Editing the photo tags...')
+		attached, detached = tag_photos(photos, add=add, remove=remove)
+		click.echo('Attached %d and detached %d tags.' % (attached, detached))
+		click.echo('Done.')
+
+	@app.cli.command()
+	@click.option('--retry-dead', is_flag=True, help='Requeue messages from the dead letter table first.')
+	def sendmail(retry_dead):
+		if retry_dead:
+			click.echo('Requeued %d dead letters.' % requeue_dead_letters(app))
+		click.echo('Sending queued mail...')
+		total, connection = 0, None
+		while True:
+			count, connection = deliver_mail(app, connection)
+			if not count:
+				break
+			total += count
+		close_connection(connection)
+		click.echo('Processed %d messages.' % total)
+		click.echo('Done.')
+
 	@app.cli.command()
 	@click.option('--user', default=10, help='Quantity of users, default is 10.')
 	@click.option('--follow', default=30, help='Quantiry of follows, default is 30.')
@@ -118,6 +195,7 @@ def register_commands(app):
 		from albumy.fakes import fake_admin, fake_comment, fake_follow, fake_photo, fake_tag, fake_user, fake_collect
 		db.drop_all()
 		db.create_all()
+		stamp()
 
 		click.echo('Initializeing the roles and permisssions..')
 		Role.init_role()
@@ -135,4 +213,8 @@ def register_commands(app):
 		fake_collect(collect)
 		click.echo('Generating %d comments...' % comment)
 		fake_comment(comment)
+		click.echo('Building the home timelines...')
+		rebuild_timeline()
+		click.echo('Building the search index...')
+		search_index.reindex()
 		click.echo('Done.')
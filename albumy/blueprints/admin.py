@@ -4,6 +4,9 @@ from albumy.decorators import admin_required, permission_required
 from albumy.extensions import db
 from albumy.forms.admin import EditProfileAdminForm
 from albumy.models import Role, User, Tag, Photo, Comment
+from albumy.pagination import paginate_keyset
+from albumy.profiling import profiler, HISTOGRAM_BUCKETS
+from albumy.tags import update_tags
 from albumy.utils import redirect_back
 
 admin_bp = Blueprint('admin', __name__)
@@ -98,6 +101,8 @@ def delete_tag(tag_id):
 	tag = Tag.query.get_or_404(tag_id)
 	db.session.delete(tag)
 	db.session.commit()
+	tag.photos_count = 0
+	update_tags([tag])
 	flash('Tag deleted', 'info')
 	return redirect_back()
 
@@ -106,14 +111,15 @@ def delete_tag(tag_id):
 @login_required
 @permission_required('MODERATE')
 def manage_photo(order):
-	page = request.args.get('page', 1, type=int)
+	cursor = request.args.get('page')
 	per_page = current_app.config['ALBUMY_MANAGE_PHOTO_PER_PAGE']
 	order_rule = 'flag'
+	photos = Photo.query.options(db.joinedload(Photo.author), db.selectinload(Photo.tags))
 	if order == 'by_time':
-		pagination = Photo.query.order_by(Photo.timestamp.desc()).paginate(page, per_page)
+		pagination = paginate_keyset(photos, Photo.timestamp, Photo.id, cursor, per_page)
 		order_rule = 'time'
 	else:
-		pagination = Photo.query.order_by(Photo.flag.desc()).paginate(page, per_page)
+		pagination = paginate_keyset(photos, Photo.flag, Photo.id, cursor, per_page)
 	photos = pagination.items
 	return render_template('admin/manage_photo.html', order_rule=order_rule, pagination=pagination, photos=photos)
 
@@ -122,7 +128,7 @@ def manage_photo(order):
 @permission_required('MODERATE')
 def manage_user():
 	filter_rule = request.args.get('filter', 'all')
-	page = request.args.get('page', 1, type=int)
+	cursor = request.args.get('page')
 	per_page = current_app.config['ALBUMY_MANAGE_USER_PER_PAGE']
 	administrator = Role.query.filter_by(name='Administrator').first()
 	moderator = Role.query.filter_by(name='Moderate').first()
@@ -138,7 +144,8 @@ def manage_user():
 	else:
 		filtered_users = User.query
 
-	pagination = filtered_users.order_by(User.member_since.desc()).paginate(page, per_page)
+	filtered_users = filtered_users.options(db.joinedload(User.role))
+	pagination = paginate_keyset(filtered_users, User.member_since, User.id, cursor, per_page)
 	users = pagination.items
 	return render_template('admin/manage_user.html', users=users, pagination=pagination)
 
@@ -146,9 +153,9 @@ def manage_user():
 @login_required
 @permission_required('MODERATE')
 def manage_tag():
-	page = request.args.get('page', 1, type=int)
+	cursor = request.args.get('page')
 	per_page = current_app.config['ALBUMY_MANAGE_TAG_PER_PAGE']
-	pagination = Tag.query.order_by(Tag.id.desc()).paginate(page, per_page)
+	pagination = paginate_keyset(Tag.query, Tag.id, Tag.id, cursor, per_page)
 	tags = pagination.items
 	return render_template('admin/manage_tag.html', tags=tags, pagination=pagination)
 
@@ -157,13 +164,29 @@ def manage_tag():
 @login_required
 @permission_required('MODERATE')
 def manage_comment(order):
-	page = request.args.get('page', 1, type=int)
+	cursor = request.args.get('page')
 	per_page = current_app.config['ALBUMY_MANAGE_COMMENT_PER_PAGE']
 	order_rule = 'flag'
+	comments = Comment.query.options(db.joinedload(Comment.author))
 	if order == 'by_time':
-		pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(page, per_page)
+		pagination = paginate_keyset(comments, Comment.timestamp, Comment.id, cursor, per_page)
 		order_rule='time'
 	else:
-		pagination = Comment.query.order_by(Comment.flag.desc()).paginate(page, per_page)
+		pagination = paginate_keyset(comments, Comment.flag, Comment.id, cursor, per_page)
 	comments = pagination.items
 	return render_template('admin/manage_comment.html', comments=comments, pagination=pagination, order_rule=order_rule)
+
+@admin_bp.route('/perf')
+@login_required
+@admin_required
+def perf():
+	endpoints, slow_queries = profiler.report()
+	return render_template('admin/perf.html', enabled=profiler.enabled, endpoints=endpoints, slow_queries=slow_queries, buckets=HISTOGRAM_BUCKETS)
+
+@admin_bp.route('/perf/reset', methods=['POST'])
+@login_required
+@admin_required
+def reset_perf():
+	profiler.reset()
+	flash('Performance statistics reset.', 'info')
+	return redirect_back()
@@ -5,11 +5,12 @@
     :copyright: © 2018 Grey Li <withlihui@gmail.com>
     :license: MIT, see LICENSE for more details.
 """
-from flask import render_template, jsonify, Blueprint
+from flask import render_template, jsonify, request, current_app, Blueprint
 from flask_login import current_user
 
-from albumy.models import User, Photo, Notification
+from albumy.models import User, Photo
 from albumy.notifications import push_collect_notification, push_follow_notification
+from albumy.tags import suggest_tags, tag_photos
 
 ajax_bp = Blueprint('ajax', __name__)
 
@@ -19,8 +20,49 @@ def notifications_count():
     if not current_user.is_authenticated:
         return jsonify(message='Login required.'), 403
 
-    count = Notification.query.with_parent(current_user).filter_by(is_read=False).count()
-    return jsonify(count=count)
+    return jsonify(count=current_user.unread_notifications_count)
+
+
+@ajax_bp.route('/uploads-status')
+def uploads_status():
+    if not current_user.is_authenticated:
+        return jsonify(message='Login required.'), 403
+
+    processing = Photo.query.with_parent(current_user).filter_by(processing=True).count()
+    return jsonify(processing=processing, done=processing == 0)
+
+
+@ajax_bp.route('/tags/suggest')
+def suggest_tag():
+    words = request.args.get('q', '').split()
+    if not words:
+        return jsonify(tags=[])
+    tags = suggest_tags(words[-1])
+    return jsonify(tags=[dict(id=tag.id, name=tag.name, count=tag.photos_count) for tag in tags])
+
+
+@ajax_bp.route('/photos/tags', methods=['POST'])
+def edit_tags():
+    if not current_user.is_authenticated:
+        return jsonify(message='Login required.'), 403
+    if not current_user.confirmed:
+        return jsonify(message='Confirm account required.'), 400
+
+    data = request.get_json(silent=True) or {}
+    photo_ids, add, remove = data.get('photo_ids'), data.get('add', []), data.get('remove', [])
+    if not isinstance(photo_ids, list) or not all(isinstance(photo_id, int) for photo_id in photo_ids):
+        return jsonify(message='A list of photo ids is required.'), 400
+    if len(photo_ids) > current_app.config['ALBUMY_TAG_BATCH_SIZE']:
+        return jsonify(message='Too many photos.'), 400
+    for names in add, remove:
+        if not isinstance(names, list) or not all(isinstance(name, str) and name.split() == [name] and len(name) <= 64 for name in names):
+            return jsonify(message='Invalid tag names.'), 400
+
+    photos = Photo.query.filter(Photo.id.in_(photo_ids))
+    if not current_user.can('MODERATE'):
+        photos = photos.filter_by(author_id=current_user.id)
+    attached, detached = tag_photos(photos, add=add, remove=remove)
+    return jsonify(message='Tags updated.', attached=attached, detached=detached)
 
 
 @ajax_bp.route('/profile/<int:user_id>')
@@ -32,14 +74,14 @@ def get_profile(user_id):
 @ajax_bp.route('/followers-count/<int:user_id>')
 def followers_count(user_id):
     user = User.query.get_or_404(user_id)
-    count = user.followers.count() - 1  # minus user self
+    count = user.followers_count
     return jsonify(count=count)
 
 
 @ajax_bp.route('/<int:photo_id>/followers-count')
 def collectors_count(photo_id):
     photo = Photo.query.get_or_404(photo_id)
-    count = len(photo.collectors)
+    count = photo.collectors_count
     return jsonify(count=count)
 
 
@@ -1,37 +1,46 @@
 import os
 
-from flask import render_template, flash, redirect, url_for, current_app, send_from_directory, request, abort, Blueprint
+from flask import render_template, flash, redirect, url_for, current_app, safe_join, request, abort, Blueprint
 from flask_login import login_required, current_user
-from sqlalchemy.sql.expression import func
 
-from albumy.decorators import confirm_required, permission_required
+from albumy.decorators import confirm_required, permission_required, query_budget, use_replica
+from albumy.explore import explore_photos
 from albumy.extensions import db
 from albumy.forms.main import DescriptionForm, TagForm, CommentForm
-from albumy.models import User, Photo, Tag, Follow, Collect, Comment, Notification
-from albumy.notifications import push_comment_notification, push_collect_notification
-from albumy.utils import rename_image, resize_image, redirect_back, flash_errors
+from albumy.models import User, Photo, Tag, Collect, Comment, Notification
+from albumy.notifications import push_comment_notification, push_collect_notification, read_notifications
+from albumy.pagination import paginate_keyset
+from albumy.search import search_index
+from albumy.tags import count_tags, get_hot_tags, tag_photos, untag_photos, update_tags
+from albumy.thumbnails import make_thumbnail, thumbnail_directory, thumbnail_filename
+from albumy.timeline import get_timeline, push_photo
+from albumy.processing import process_photo
+from albumy.utils import rename_image, send_upload, redirect_back, flash_errors, negotiate_image_format, supported_image_formats
 
 main_bp = Blueprint('main', __name__)
 
 @main_bp.route('/')
 def index():
 	if current_user.is_authenticated:
-		page = request.args.get('page', 1, type=int)
+		cursor = request.args.get('page')
 		per_page = current_app.config['ALBUMY_PHOTO_PER_PAGE']
-		pagination = Photo.query.join(Follow, Follow.followed_id == Photo.author_id).filter(Follow.follower_id == current_user.id).order_by(Photo.timestamp.desc()).paginate(page, per_page)
+		pagination = get_timeline(current_user, cursor, per_page)
 		photos = pagination.items
+		current_user.load_collect_status(photos)
 	else:
 		pagination = None
 		photos = None
-	tags = Tag.query.join(Tag.photos).group_by(Tag.id).order_by(func.count(Photo.id).desc()).limit(10)
+	tags = get_hot_tags()
 	return render_template('main/index.html', pagination=pagination, photos=photos, tags=tags, Collect=Collect)
 
 @main_bp.route('/explore')
+@use_replica
 def explore():
-	photos = Photo.query.order_by(func.random()).limit(12)
+	photos = explore_photos(current_app.config['ALBUMY_EXPLORE_PER_PAGE'])
 	return render_template('main/explore.html', photos=photos)
 
 @main_bp.route('/search')
+@use_replica
 def search():
 	q = request.args.get('q', '')
 	if q == '':
@@ -42,24 +51,27 @@ def search():
 	page = request.args.get('page', 1, type=int)
 	per_page = current_app.config['ALBUMY_SEARCH_RESULT_PER_PAGE']
 	if category == 'user':
-		pagination = User.query.whooshee_search('q').paginate(page, per_page)
+		model = User
 	elif category == 'tag':
-		pagination = Tag.query.whooshee_search('q').paginate(page, per_page)
+		model = Tag
 	else:
-		pagination = Photo.query.whooshee_search('q').paginate(page, per_page)
+		model = Photo
+	pagination = search_index.paginate(model, q, page, per_page)
 	results = pagination.items
+	if model is User and current_user.is_authenticated:
+		current_user.load_follow_status(results)
 	return render_template('main/search.html', q=q, results=results, pagination=pagination, category=category)
 
 @main_bp.route('/notification')
 @login_required
 def show_notification():
-	page = request.args.get('page', 1, type=int)
+	cursor = request.args.get('page')
 	per_page = current_app.config['ALBUMY_NOTIFICATION_PER_PAGE']
-	notifications = Notification.query.with_parent(current_user)
+	notifications = Notification.query.with_parent(current_user).options(db.joinedload(Notification.actor))
 	filter_rule = request.args.get('filter')
 	if filter_rule == 'unread':
 		notifications = notifications.filter_by(is_read=False)
-	pagination = notifications.order_by(Notification.timestamp.desc()).paginate(page, per_page)
+	pagination = paginate_keyset(notifications, Notification.timestamp, Notification.id, cursor, per_page)
 	notifications = pagination.items
 	return render_template('main/notifications.html', pagination=pagination, notifications=notifications)
 		
@@ -70,27 +82,55 @@ def read_notification(notification_id):
 	if current_user != notification.receiver:
 		abort(403)
 
-	notification.is_read = True
-	db.session.commit()
+	read_notifications(current_user, notification_id=notification.id)
 	flash('Notification archived', 'success')
 	return redirect(url_for('main.show_notification'))
 
 @main_bp.route('/notification/read/all', methods=['POST'])
 @login_required
 def read_all_notification():
-	for notification in current_user.notifications:
-		notification.is_read = True
-	db.session.commit()
+	read_notifications(current_user, max_id=request.form.get('max_id', type=int), type=request.form.get('type') or None)
 	flash('all notifications archired', 'success')
 	return redirect(url_for('main.show_notification'))
 
 @main_bp.route('/uploads/<path:filename>')
 def get_image(filename):
-	return send_from_directory(current_app.config['ALBUMY_UPLOAD_PATH'], filename)
+	upload_path = current_app.config['ALBUMY_UPLOAD_PATH']
+	base = os.path.splitext(filename)[0]
+	formats = []
+	for ext, quality in current_app.config['ALBUMY_PHOTO_FORMATS']:
+		path = safe_join(upload_path, base + '.' + ext)
+		if path is not None and os.path.exists(path):
+			formats.append(ext)
+	variant = negotiate_image_format(formats)
+	prefix = current_app.config['ALBUMY_UPLOAD_ACCEL_PREFIX']
+	if variant is None:
+		response = send_upload(upload_path, filename, prefix)
+	else:
+		response = send_upload(upload_path, base + '.' + variant, prefix, mimetype='image/' + variant)
+	if formats:
+		response.vary.add('Accept')
+	return response
+
+@main_bp.route('/thumbnails/<int:width>/<path:filename>')
+def get_thumbnail(width, filename):
+	if width not in current_app.config['ALBUMY_THUMBNAIL_WIDTHS']:
+		abort(404)
+	formats = [ext for ext, quality in supported_image_formats()]
+	variant = negotiate_image_format(formats)
+	make_thumbnail(filename, width, variant)
+	prefix = current_app.config['ALBUMY_THUMBNAIL_ACCEL_PREFIX'] + '%d/' % width
+	if variant is None:
+		response = send_upload(thumbnail_directory(width), filename, prefix)
+	else:
+		response = send_upload(thumbnail_directory(width), thumbnail_filename(filename, variant), prefix, mimetype='image/' + variant)
+	if formats:
+		response.vary.add('Accept')
+	return response
 
 @main_bp.route('/avatars/<path:filename>')
 def get_avatar(filename):
-	return send_from_directory(current_app.config['AVATARS_SAVE_PATH'], filename)
+	return send_upload(current_app.config['AVATARS_SAVE_PATH'], filename, current_app.config['ALBUMY_AVATAR_ACCEL_PREFIX'])
 
 @main_bp.route('/upload', methods=['GET', 'POST'])
 @login_required
@@ -101,19 +141,22 @@ def upload():
 		f = request.files.get('file')
 		filename = rename_image(f.filename)
 		f.save(os.path.join(current_app.config['ALBUMY_UPLOAD_PATH'], filename))
-		filename_s = resize_image(f, filename, current_app.config['ALBUMY_PHOTO_SIZE']['small'])
-		filename_m = resize_image(f, filename, current_app.config['ALBUMY_PHOTO_SIZE']['medium'])
-		photo = Photo(filename=filename, filename_s=filename_s, filename_m=filename_m, author=current_user._get_current_object())
+		photo = Photo(filename=filename, filename_s=filename, filename_m=filename, processing=True, author=current_user._get_current_object())
 		db.session.add(photo)
+		current_user.photos_count = User.photos_count + 1
+		db.session.flush()
+		push_photo(photo)
 		db.session.commit()
+		process_photo(photo)
 	return render_template('main/upload.html')
 
 @main_bp.route('/photo/<int:photo_id>')
 def show_photo(photo_id):
-	photo = Photo.query.get_or_404(photo_id)
-	page = request.args.get('page', 1, type=int)
+	photo = Photo.query.options(db.joinedload(Photo.author), db.selectinload(Photo.tags)).filter_by(id=photo_id).first_or_404()
+	cursor = request.args.get('page')
 	per_page = current_app.config['ALBUMY_COMMENT_PER_PAGE']
-	pagination = Comment.query.with_parent(photo).order_by(Comment.timestamp.asc()).paginate(page, per_page)
+	comments = Comment.query.with_parent(photo).options(db.joinedload(Comment.author), db.joinedload(Comment.replied).joinedload(Comment.author))
+	pagination = paginate_keyset(comments, Comment.timestamp, Comment.id, cursor, per_page, descending=False)
 	comments = pagination.items
 
 	comment_form = CommentForm()
@@ -166,12 +209,7 @@ def new_tag(photo_id):
 
 	form = TagForm()
 	if form.validate_on_submit():
-		for name in form.tag.data.split():
-			tag = Tag.query.filter_by(name=name).first()
-			if tag is None:
-				tag = Tag(name=name)
-			photo.tags.append(tag)
-		db.session.commit()
+		tag_photos(Photo.query.filter_by(id=photo.id), add=form.tag.data.split())
 		flash('Tag added', 'success')
 
 	flash_errors(form)
@@ -179,16 +217,13 @@ def new_tag(photo_id):
 
 @main_bp.route('/photo/<int:photo_id>/<int:tag_id>', methods=['POST'])
 @login_required
-def delete_tag(photo_id):
+def delete_tag(photo_id, tag_id):
 	photo = Photo.query.get_or_404(photo_id)
 	tag = Tag.query.get_or_404(tag_id)
 	if current_user != photo.author and not current_user.can('MODERATE'):
 		abort(403)
 	if tag in photo.tags:
-		photo.tags.remove(tag)
-		if not tag.photos:
-			db.session.delete(tag)
-		db.session.commit()
+		tag_photos(Photo.query.filter_by(id=photo.id), remove=[tag.name])
 		flash('Tag(s) removed', 'info')
 	flash('No such tag(s) attached in this photo', 'warning')
 	return redirect(url_for('main.show_photo', photo_id=photo_id))
@@ -233,12 +268,15 @@ def report_photo(photo_id):
 	return redirect(url_for('main.show_photo', photo_id=photo_id))
 
 @main_bp.route('/photo/<int:photo_id>/collectors')
+@use_replica
 def show_collectors(photo_id):
 	photo = Photo.query.get_or_404(photo_id)
-	page = request.args.get('page', 1, type=int)
+	cursor = request.args.get('page')
 	per_page = current_app.config['ALBUMY_USER_PER_PAGE']
-	pagination = Collect.query.with_parent(photo).order_by(Collect.timestamp.asc()).paginate(page, per_page)
+	pagination = paginate_keyset(Collect.query.with_parent(photo).options(db.joinedload(Collect.collector)), Collect.timestamp, Collect.collector_id, cursor, per_page, descending=False)
 	collects = pagination.items
+	if current_user.is_authenticated:
+		current_user.load_follow_status([collect.collector for collect in collects])
 	return render_template('main/collectors.html', pagination=pagination, collects=collects, photo=photo)
 		
 		
@@ -246,13 +284,20 @@ def show_collectors(photo_id):
 	
 @main_bp.route('/delete/photo/<int:photo_id>', methods=['POST'])
 @login_required
+@query_budget(None)
 def delete_photo(photo_id):
 	photo = Photo.query.get_or_404(photo_id)
 	if current_user != photo.author and not current_user.can('MODERATE'):
 		abort(403)
-		
+
+	photo.author.photos_count = User.photos_count - 1
+	deltas = untag_photos(Photo.query.filter_by(id=photo.id))
+	collectors = db.session.query(Collect.collector_id).filter(Collect.collected_id == photo.id)
+	User.query.filter(User.id.in_(collectors)).update({User.collections_count: User.collections_count - 1}, synchronize_session=False)
 	db.session.delete(photo)
+	ranked = count_tags(deltas)
 	db.session.commit()
+	update_tags(ranked)
 	flash('Photo deleted', 'info')
 
 	photo_n = Photo.query.with_parent(photo.author).filter(Photo.id < photo.id).order_by(Photo.id.desc()).first()
@@ -265,16 +310,17 @@ def delete_photo(photo_id):
 
 @main_bp.route('/tag/<int:tag_id>', defaults={'order': 'by_time'})
 @main_bp.route('/tag/<int:tag_id>/<order>')
+@use_replica
 def show_tag(tag_id, order):
 	tag = Tag.query.get_or_404(tag_id)
-	page = request.args.get('page', 1, type=int)
+	cursor = request.args.get('page')
 	per_page = current_app.config['ALBUMY_PHOTO_PER_PAGE']
-	pagination = Photo.query.with_parent(tag).order_by(Photo.timestamp.desc()).paginate(page, per_page)
+	pagination = paginate_keyset(Photo.query.with_parent(tag), Photo.timestamp, Photo.id, cursor, per_page)
 	photos = pagination.items
 	order_rule = 'time'
 
 	if order == 'by_collects':
-		photos.sort(key=lambda x: len(x.collectors), reverse=True)
+		photos.sort(key=lambda x: x.collectors_count, reverse=True)
 		order_rule = 'collects'
 	return render_template('main/tag.html', order_rule=order_rule, pagination=pagination, photos=photos, tag=tag)
 
@@ -293,7 +339,7 @@ def report_comment(comment_id):
 @permission_required('COMMENT')
 def new_comment(photo_id):
 	photo = Photo.query.get_or_404(photo_id)
-	page = request.args.get('page', 1, type=int)
+	page = request.args.get('page')
 	form = CommentForm()
 	if form.validate_on_submit():
 		comment = Comment(body=form.body.data, author=current_user._get_current_object(), photo=photo)
@@ -302,13 +348,14 @@ def new_comment(photo_id):
 		if replied_id:
 			comment.replied = Comment.query.get_or_404(replied_id)
 			if comment.replied.author.receive_comment_notification:
-				push_comment_notification(photo_id, comment.replied.author)
+				push_comment_notification(current_user, photo_id, comment.replied.author)
 		db.session.add(comment)
+		photo.comments_count = Photo.comments_count + 1
 		db.session.commit()
 		flash('Comment publiched', 'success')
 
-		if current_user != photo.auther and photo.author.receive_comment_notification:
-			push_comment_notification(photo_id, photo.author, page=page)
+		if current_user != photo.author and photo.author.receive_comment_notification:
+			push_comment_notification(current_user, photo_id, photo.author)
 	
 	flash_errors(form)
 	return redirect(url_for('main.show_photo', photo_id=photo_id, page=page))
@@ -343,7 +390,10 @@ def delete_comment(comment_id):
 	if current_user != comment.author or not current_user.can('MODERATE'):
 		abort(403)
 	
+	photo = comment.photo
 	db.session.delete(comment)
+	db.session.flush()
+	photo.comments_count = Comment.query.with_parent(photo).count()
 	db.session.commit()
 	flash('comment deleted', 'info')
 	return redirect(url_for('main.show_photo', photo_id=comment.photo_id))
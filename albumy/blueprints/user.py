@@ -1,18 +1,21 @@
 from flask import render_template, flash, redirect, url_for, current_app, request, Blueprint
 from flask_login import login_required, current_user, fresh_login_required, logout_user
 
-from albumy.decorators import confirm_required, permission_required
+from albumy.decorators import confirm_required, permission_required, query_budget, use_replica
 from albumy.emails import send_change_email_email
 from albumy.extensions import db, avatars
 from albumy.forms.user import EditProfileForm, UploadAvatarForm, CropAvatarForm, ChangeEmailForm, ChangePasswordForm, NotificationSettingForm, PrivacySettingForm, DeleteAccountForm
-from albumy.models import User, Photo, Collect, Follow
+from albumy.models import User, Photo, Collect, Comment, Follow
 from albumy.notifications import push_follow_notification
+from albumy.pagination import paginate_keyset
 from albumy.settings import Operations
+from albumy.tags import count_tags, untag_photos, update_tags
 from albumy.utils import generate_token, validate_token, redirect_back, flash_errors
 
 user_bp = Blueprint('user', __name__)
 
 @user_bp.route('/<username>')
+@use_replica
 def index(username):
 	user = User.query.filter_by(username=username).first_or_404()
 	if user == current_user and user.locked:
@@ -20,18 +23,19 @@ def index(username):
 	if user == current_user and not user.active:
 		logout_user()
 
-	page = request.args.get('page', 1, type=int)
+	cursor = request.args.get('page')
 	per_page = current_app.config['ALBUMY_PHOTO_PER_PAGE']
-	pagination = Photo.query.with_parent(user).order_by(Photo.timestamp.desc()).paginate(page, per_page)
+	pagination = paginate_keyset(Photo.query.with_parent(user), Photo.timestamp, Photo.id, cursor, per_page)
 	photos = pagination.items
 	return render_template('user/index.html', user=user, pagination=pagination, photos=photos)
 
 @user_bp.route('/<username>/collections')
+@use_replica
 def show_collections(username):
 	user = User.query.filter_by(username=username).first_or_404()
-	page = request.args.get('page', 1, type=int)
+	cursor = request.args.get('page')
 	per_page = current_app.config['ALBUMY_PHOTO_PER_PAGE']
-	pagination = Collect.query.with_parent(user).order_by(Collect.timestamp.desc()).paginate(page, per_page)
+	pagination = paginate_keyset(Collect.query.with_parent(user).options(db.joinedload(Collect.collected)), Collect.timestamp, Collect.collected_id, cursor, per_page)
 	collects = pagination.items
 	return render_template('user/collections.html', user=user, pagination=pagination, collects=collects)
 
@@ -63,21 +67,27 @@ def unfollow(username):
 	return redirect_back()
 
 @user_bp.route('/<username>/followers')
+@use_replica
 def show_followers(username):
 	user = User.query.filter_by(username=username).first_or_404()
-	page = request.args.get('page', 1, type=int)
+	cursor = request.args.get('page')
 	per_page = current_app.config['ALBUMY_USER_PER_PAGE']
-	pagination = Follow.query.filter_by(followed_id=user.id).order_by(Follow.timestamp.desc()).paginate(page, per_page)
+	pagination = paginate_keyset(Follow.query.filter_by(followed_id=user.id).options(db.joinedload(Follow.follower)), Follow.timestamp, Follow.follower_id, cursor, per_page)
 	follows = pagination.items
+	if current_user.is_authenticated:
+		current_user.load_follow_status([follow.follower for follow in follows])
 	return render_template('user/followers.html', user=user, pagination=pagination, follows=follows)
 
 @user_bp.route('/<username>/following')
+@use_replica
 def show_following(username):
 	user = User.query.filter_by(username=username).first_or_404()
-	page = request.args.get('page', 1, type=int)
+	cursor = request.args.get('page')
 	per_page = current_app.config['ALBUMY_USER_PER_PAGE']
-	pagination = user.following.paginate(page, per_page)
+	pagination = paginate_keyset(user.following.options(db.joinedload(Follow.followed)), Follow.timestamp, Follow.followed_id, cursor, per_page)
 	follows = pagination.items
+	if current_user.is_authenticated:
+		current_user.load_follow_status([follow.followed for follow in follows])
 	return render_template('user/following.html', user=user, pagination=pagination, follows=follows)
 
 @user_bp.route('/settings/profile', methods=['GET', 'POST'])
@@ -207,11 +217,29 @@ def privacy_setting():
 
 @user_bp.route('/settingg/account/delete', methods=['GET', 'POST'])
 @login_required
+@query_budget(None)
 def delete_account():
 	form = DeleteAccountForm()
 	if form.validate_on_submit():
-		db.session.delete(current_user._get_current_object())
+		user = current_user._get_current_object()
+		followed = db.session.query(Follow.followed_id).filter(Follow.follower_id == user.id, Follow.followed_id != user.id)
+		User.query.filter(User.id.in_(followed)).update({User.followers_count: User.followers_count - 1}, synchronize_session=False)
+		followers = db.session.query(Follow.follower_id).filter(Follow.followed_id == user.id, Follow.follower_id != user.id)
+		User.query.filter(User.id.in_(followers)).update({User.following_count: User.following_count - 1}, synchronize_session=False)
+		collected = db.session.query(Collect.collected_id).filter(Collect.collector_id == user.id)
+		Photo.query.filter(Photo.id.in_(collected)).update({Photo.collectors_count: Photo.collectors_count - 1}, synchronize_session=False)
+		commented = [photo_id for photo_id, in db.session.query(Comment.photo_id).filter(Comment.author_id == user.id).distinct()]
+		collections = db.select([db.func.count(Collect.collected_id)]).select_from(Collect.__table__.join(Photo.__table__, Photo.id == Collect.collected_id)).where(Collect.collector_id == User.id).where(Photo.author_id == user.id).as_scalar()
+		collectors = db.session.query(Collect.collector_id).join(Photo, Photo.id == Collect.collected_id).filter(Photo.author_id == user.id)
+		User.query.filter(User.id.in_(collectors)).update({User.collections_count: User.collections_count - collections}, synchronize_session=False)
+		deltas = untag_photos(Photo.query.with_parent(user))
+		db.session.delete(user)
+		ranked = count_tags(deltas)
+		if commented:
+			comments = db.select([db.func.count(Comment.id)]).where(Comment.photo_id == Photo.id).as_scalar()
+			Photo.query.filter(Photo.id.in_(commented)).update({Photo.comments_count: comments}, synchronize_session=False)
 		db.session.commit()
+		update_tags(ranked)
 		flash('Your are free, bye', 'sucess')
 		return redirect(url_for('main.index'))
 	return render_template('user/settings/delete_account.html', form=form)
@@ -0,0 +1,127 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from flask import current_app
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from werkzeug.utils import import_string
+
+def make_key(*parts):
+	return ':'.join(str(part) for part in parts)
+
+class NullBackend(object):
+	def __init__(self, app):
+		pass
+
+	def get(self, key):
+		return None
+
+	def set(self, key, value, timeout):
+		pass
+
+	def delete(self, key):
+		pass
+
+	def clear(self):
+		pass
+
+class SimpleBackend(object):
+	def __init__(self, app):
+		self.threshold = app.config['ALBUMY_CACHE_THRESHOLD']
+		self.entries = OrderedDict()
+		self.lock = Lock()
+
+	def get(self, key):
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is None:
+				return None
+			value, expires = entry
+			if expires is not None and expires < time.time():
+				del self.entries[key]
+				return None
+			self.entries.move_to_end(key)
+			return value
+
+	def set(self, key, value, timeout):
+		with self.lock:
+			self.entries[key] = (value, time.time() + timeout if timeout else None)
+			self.entries.move_to_end(key)
+			while len(self.entries) > self.threshold:
+				self.entries.popitem(last=False)
+
+	def delete(self, key):
+		with self.lock:
+			self.entries.pop(key, None)
+
+	def clear(self):
+		with self.lock:
+			self.entries.clear()
+
+class RedisBackend(object):
+	def __init__(self, app):
+		import redis
+		self.client = redis.StrictRedis.from_url(app.config['ALBUMY_CACHE_REDIS_URL'])
+		self.prefix = 'albumy:fragment:'
+
+	def get(self, key):
+		value = self.client.get(self.prefix + key)
+		return value.decode('utf-8') if value is not None else None
+
+	def set(self, key, value, timeout):
+		self.client.set(self.prefix + key, value.encode('utf-8'), ex=timeout or None)
+
+	def delete(self, key):
+		self.client.delete(self.prefix + key)
+
+	def clear(self):
+		keys = list(self.client.scan_iter(self.prefix + '*'))
+		if keys:
+			self.client.delete(*keys)
+
+backends = {'null': NullBackend, 'simple': SimpleBackend, 'redis': RedisBackend}
+
+class FragmentCacheExtension(Extension):
+	tags = set(['cache'])
+
+	def parse(self, parser):
+		lineno = next(parser.stream).lineno
+		args = [parser.parse_expression()]
+		while parser.stream.skip_if('comma'):
+			args.append(parser.parse_expression())
+		body = parser.parse_statements(['name:endcache'], drop_needle=True)
+		return nodes.CallBlock(self.call_method('_render', [args[0], nodes.List(args[1:])]), [], [], body).set_lineno(lineno)
+
+	def _render(self, timeout, parts, caller):
+		return Markup(cache.fetch(make_key('fragment', *parts), caller, timeout))
+
+class FragmentCache(object):
+	def init_app(self, app):
+		backend = app.config['ALBUMY_CACHE_BACKEND']
+		backend = backends[backend] if backend in backends else import_string(backend)
+		app.extensions['fragment_cache'] = backend(app)
+		app.jinja_env.add_extension(FragmentCacheExtension)
+
+	@property
+	def backend(self):
+		return current_app.extensions['fragment_cache']
+
+	def fetch(self, key, render, timeout=None):
+		value = self.backend.get(key)
+		if value is None:
+			value = str(render())
+			self.backend.set(key, value, current_app.config['ALBUMY_CACHE_TIMEOUT'] if timeout is None else timeout)
+		return value
+
+	def delete(self, *parts):
+		self.backend.delete(make_key(*parts))
+
+	def delete_fragment(self, *parts):
+		self.delete('fragment', *parts)
+
+	def clear(self):
+		self.backend.clear()
+
+cache = FragmentCache()
@@ -0,0 +1,41 @@
+from flask import g, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, event, orm
+from sqlalchemy.sql.dml import UpdateBase
+
+def sqlite_pragmas(config):
+	pragmas = [('journal_mode', config['ALBUMY_SQLITE_JOURNAL_MODE']), ('synchronous', config['ALBUMY_SQLITE_SYNCHRONOUS']), ('busy_timeout', config['ALBUMY_SQLITE_BUSY_TIMEOUT'])]
+	pragmas = [(name, value) for name, value in pragmas if value is not None]
+
+	def set_pragmas(connection, record):
+		cursor = connection.cursor()
+		for name, value in pragmas:
+			cursor.execute('PRAGMA %s = %s' % (name, value))
+		cursor.close()
+	return set_pragmas
+
+class RoutingSession(SignallingSession):
+	def get_bind(self, mapper=None, clause=None):
+		if has_request_context() and g.get('use_replica'):
+			if self._flushing or isinstance(clause, UpdateBase):
+				g.use_replica = False
+			else:
+				replica = self.app.extensions.get('replica_engine')
+				if replica is not None:
+					return replica
+		return SignallingSession.get_bind(self, mapper, clause)
+
+class RoutingSQLAlchemy(SQLAlchemy):
+	def create_session(self, options):
+		return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+	def init_app(self, app):
+		super(RoutingSQLAlchemy, self).init_app(app)
+		engines = [self.get_engine(app)]
+		if app.config['ALBUMY_REPLICA_DATABASE_URI']:
+			replica = create_engine(app.config['ALBUMY_REPLICA_DATABASE_URI'], **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+			app.extensions['replica_engine'] = replica
+			engines.append(replica)
+		for engine in engines:
+			if engine.dialect.name == 'sqlite':
+				event.listen(engine, 'connect', sqlite_pragmas(app.config))
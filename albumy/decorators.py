@@ -7,7 +7,7 @@
 """
 from functools import wraps
 
-from flask import Markup, flash, url_for, redirect, abort
+from flask import Markup, flash, url_for, redirect, abort, g
 from flask_login import current_user
 
 
@@ -39,3 +39,21 @@ def permission_required(permission_name):
 
 def admin_required(func):
     return permission_required('ADMINISTER')(func)
+
+
+def query_budget(count):
+    def decorator(func):
+        @wraps(func)
+        def decorated_function(*args, **kwargs):
+            g.query_budget = count
+            return func(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def use_replica(func):
+    @wraps(func)
+    def decorated_function(*args, **kwargs):
+        g.use_replica = True
+        return func(*args, **kwargs)
+    return decorated_function
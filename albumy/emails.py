@@ -5,17 +5,144 @@
     :copyright: © 2018 Grey Li <withlihui@gmail.com>
     :license: MIT, see LICENSE for more details.
 """
-from threading import Thread
+import json
+import smtplib
+import sqlite3
+import time
+from contextlib import closing
+from threading import Event, Lock, Thread
 
 from flask import current_app, render_template
 from flask_mail import Message
 
 from albumy.extensions import mail
 
+PERMANENT_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused)
 
-def _send_async_mail(app, message):
+workers = []
+workers_lock = Lock()
+wakeup = Event()
+
+
+def connect_queue(app):
+    db = sqlite3.connect(app.config['ALBUMY_MAIL_QUEUE_PATH'], timeout=30, isolation_level=None)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('CREATE TABLE IF NOT EXISTS mail_queue (id INTEGER PRIMARY KEY AUTOINCREMENT, message TEXT NOT NULL, '
+               'attempts INTEGER NOT NULL DEFAULT 0, next_attempt REAL NOT NULL, locked_until REAL NOT NULL DEFAULT 0)')
+    db.execute('CREATE INDEX IF NOT EXISTS ix_mail_queue_next_attempt ON mail_queue (next_attempt)')
+    db.execute('CREATE TABLE IF NOT EXISTS mail_dead_letter (id INTEGER PRIMARY KEY, message TEXT NOT NULL, '
+               'attempts INTEGER NOT NULL, error TEXT, failed_at REAL NOT NULL)')
+    return db
+
+
+def enqueue_mail(app, message):
+    data = json.dumps(dict(subject=message.subject, sender=message.sender, recipients=message.recipients,
+                           body=message.body, html=message.html))
+    with closing(connect_queue(app)) as db:
+        return db.execute('INSERT INTO mail_queue (message, next_attempt) VALUES (?, ?)', (data, time.time())).lastrowid
+
+
+def claim_mail(app, limit):
+    now = time.time()
+    with closing(connect_queue(app)) as db:
+        db.execute('BEGIN IMMEDIATE')
+        rows = db.execute('SELECT id, message, attempts FROM mail_queue WHERE next_attempt <= ? AND locked_until <= ? '
+                          'ORDER BY next_attempt LIMIT ?', (now, now, limit)).fetchall()
+        db.executemany('UPDATE mail_queue SET locked_until = ? WHERE id = ?',
+                       [(now + app.config['ALBUMY_MAIL_LEASE'], row[0]) for row in rows])
+        db.execute('COMMIT')
+    return rows
+
+
+def load_message(data):
+    data = json.loads(data)
+    if isinstance(data['sender'], list):
+        data['sender'] = tuple(data['sender'])
+    return Message(**data)
+
+
+def complete_mail(app, id):
+    with closing(connect_queue(app)) as db:
+        db.execute('DELETE FROM mail_queue WHERE id = ?', (id,))
+
+
+def fail_mail(app, id, attempts, error, permanent=False):
+    attempts += 1
+    with closing(connect_queue(app)) as db:
+        if permanent or attempts >= app.config['ALBUMY_MAIL_MAX_ATTEMPTS']:
+            db.execute('BEGIN IMMEDIATE')
+            db.execute('INSERT INTO mail_dead_letter (id, message, attempts, error, failed_at) '
+                       'SELECT id, message, ?, ?, ? FROM mail_queue WHERE id = ?', (attempts, str(error), time.time(), id))
+            db.execute('DELETE FROM mail_queue WHERE id = ?', (id,))
+            db.execute('COMMIT')
+        else:
+            delay = app.config['ALBUMY_MAIL_RETRY_DELAY'] * 2 ** (attempts - 1)
+            db.execute('UPDATE mail_queue SET attempts = ?, next_attempt = ?, locked_until = 0 WHERE id = ?',
+                       (attempts, time.time() + delay, id))
+
+
+def deliver_mail(app, connection=None):
+    batch = claim_mail(app, app.config['ALBUMY_MAIL_BATCH_SIZE'])
+    for id, data, attempts in batch:
+        try:
+            message = load_message(data)
+            if connection is None:
+                connection = mail.connect().__enter__()
+            connection.send(message)
+        except PERMANENT_ERRORS as e:
+            fail_mail(app, id, attempts, e, permanent=True)
+        except (smtplib.SMTPException, OSError) as e:
+            app.logger.warning('Failed to send mail %d: %s', id, e)
+            fail_mail(app, id, attempts, e)
+            connection = close_connection(connection)
+        except Exception as e:
+            app.logger.exception('Failed to send mail %d.', id)
+            fail_mail(app, id, attempts, e)
+            connection = close_connection(connection)
+        else:
+            complete_mail(app, id)
+    return len(batch), connection
+
+
+def close_connection(connection):
+    if connection is not None:
+        try:
+            connection.__exit__(None, None, None)
+        except (smtplib.SMTPException, OSError):
+            pass
+
+
+def _deliver_forever(app):
+    connection = None
     with app.app_context():
-        mail.send(message)
+        while True:
+            wakeup.clear()
+            try:
+                count, connection = deliver_mail(app, connection)
+            except Exception:
+                app.logger.exception('Mail worker failed.')
+                count, connection = 0, close_connection(connection)
+            if not count:
+                connection = close_connection(connection)
+                wakeup.wait(app.config['ALBUMY_MAIL_POLL_INTERVAL'])
+
+
+def requeue_dead_letters(app):
+    with closing(connect_queue(app)) as db:
+        db.execute('BEGIN IMMEDIATE')
+        count = db.execute('INSERT INTO mail_queue (message, next_attempt) '
+                           'SELECT message, ? FROM mail_dead_letter', (time.time(),)).rowcount
+        db.execute('DELETE FROM mail_dead_letter')
+        db.execute('COMMIT')
+    return count
+
+
+def start_workers(app):
+    with workers_lock:
+        while len(workers) < app.config['ALBUMY_MAIL_WORKERS']:
+            worker = Thread(target=_deliver_forever, args=[app], daemon=True)
+            worker.start()
+            workers.append(worker)
 
 
 def send_mail(to, subject, template, **kwargs):
@@ -23,9 +150,13 @@ def send_mail(to, subject, template, **kwargs):
     message.body = render_template(template + '.txt', **kwargs)
     message.html = render_template(template + '.html', **kwargs)
     app = current_app._get_current_object()
-    thr = Thread(target=_send_async_mail, args=[app, message])
-    thr.start()
-    return thr
+    id = enqueue_mail(app, message)
+    if not app.config['ALBUMY_MAIL_WORKERS']:
+        close_connection(deliver_mail(app)[1])
+    else:
+        start_workers(app)
+        wakeup.set()
+    return id
 
 
 def send_confirm_email(user, token, to=None):
@@ -0,0 +1,77 @@
+import bisect
+import itertools
+import random
+import time
+from datetime import datetime
+from threading import Lock
+
+from flask import current_app
+
+from albumy.extensions import db
+from albumy.models import Photo
+
+pool = None
+pool_lock = Lock()
+
+def photo_weight(collectors_count, timestamp, now):
+	weighting = current_app.config['ALBUMY_EXPLORE_WEIGHT']
+	if weighting == 'collects':
+		return 1.0 + (collectors_count or 0)
+	if weighting == 'recent':
+		age = (now - timestamp).total_seconds() if timestamp is not None else 0
+		return 0.5 ** (max(age, 0) / current_app.config['ALBUMY_EXPLORE_HALF_LIFE'])
+	return 1.0
+
+def probe_photos(min_id, max_id, size):
+	windows = current_app.config['ALBUMY_EXPLORE_WINDOWS']
+	per_window = size // windows + 1
+	rows = {}
+	for start in random.sample(range(min_id, max_id + 1), min(windows, max_id - min_id + 1)):
+		photos = db.session.query(Photo.id, Photo.collectors_count, Photo.timestamp).filter(Photo.id >= start).order_by(Photo.id).limit(per_window)
+		for row in photos:
+			rows[row[0]] = row
+	return list(rows.values())
+
+def load_pool():
+	size = current_app.config['ALBUMY_EXPLORE_POOL_SIZE']
+	min_id, max_id, count = db.session.query(db.func.min(Photo.id), db.func.max(Photo.id), db.func.count(Photo.id)).one()
+	if not count:
+		rows = []
+	elif count <= size:
+		rows = db.session.query(Photo.id, Photo.collectors_count, Photo.timestamp).all()
+	else:
+		rows = probe_photos(min_id, max_id, size)
+	now = datetime.utcnow()
+	ids = [row[0] for row in rows]
+	weights = list(itertools.accumulate(photo_weight(row[1], row[2], now) for row in rows))
+	return dict(expires=time.time() + current_app.config['ALBUMY_EXPLORE_POOL_TTL'], ids=ids, weights=weights)
+
+def get_pool():
+	global pool
+	with pool_lock:
+		if pool is None or pool['expires'] < time.time():
+			pool = load_pool()
+		return pool
+
+def sample_photo_ids(count):
+	pool = get_pool()
+	ids, weights = pool['ids'], pool['weights']
+	if len(ids) <= count:
+		return random.sample(ids, len(ids))
+	if current_app.config['ALBUMY_EXPLORE_WEIGHT'] is None:
+		return random.sample(ids, count)
+	sample = []
+	seen = set()
+	for attempt in range(count * 4):
+		photo_id = ids[min(bisect.bisect(weights, random.random() * weights[-1]), len(ids) - 1)]
+		if photo_id not in seen:
+			seen.add(photo_id)
+			sample.append(photo_id)
+			if len(sample) == count:
+				break
+	return sample
+
+def explore_photos(count):
+	photo_ids = sample_photo_ids(count)
+	photos = dict((photo.id, photo) for photo in Photo.query.filter(Photo.id.in_(photo_ids))) if photo_ids else {}
+	return [photos[photo_id] for photo_id in photo_ids if photo_id in photos]
@@ -3,15 +3,18 @@ from flask_bootstrap import Bootstrap
 from flask_dropzone import Dropzone
 from flask_login import LoginManager, AnonymousUserMixin
 from flask_mail import Mail
+from flask_migrate import Migrate
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
 from flask_whooshee import Whooshee
 from flask_wtf import CSRFProtect
 
+from albumy.database import RoutingSQLAlchemy
+
 bootstrap = Bootstrap()
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 login_manager = LoginManager()
 mail = Mail()
+migrate = Migrate()
 dropzone = Dropzone()
 moment = Moment()
 whooshee = Whooshee()
@@ -20,8 +23,8 @@ csrf = CSRFProtect()
 
 @login_manager.user_loader
 def load_user(user_id):
-	from albumy.models import User
-	user = User.query.get(int(user_id))
+	from albumy.models import get_session_user
+	user = get_session_user(int(user_id))
 	return user
 
 login_manager.login_view = 'auth.login'
@@ -8,11 +8,12 @@ from sqlalchemy.exc import IntegrityError
 
 from albumy.extensions import db
 from albumy.models import User, Photo, Tag, Comment, Notification
+from albumy.tags import count_tagging
 
 fake = Faker('zh_CN')
 
 def fake_admin():
-	admin = User(name='Laonana', username='laonana', email='laonana@laonana.com', bio=fake.sentence(), website='http://laonana.com', confirmed=True)
+	admin = User(name='Laonana', username='laonana', email='laonana@laonana.com', bio=fake.sentence(), website='http://laonana.com', confirmed=True, unread_notifications_count=1)
 	admin.set_password('password')
 	notification = Notification(message='Hello, welcome to Albumy.', receiver=admin)
 	db.session.add(notification)
@@ -59,6 +60,8 @@ def fake_photo(count=30):
 			tag = Tag.query.get(random.randint(1, Tag.query.count()))
 			if tag not in photo.tags:
 				photo.tags.append(tag)
+				count_tagging(tag, 1)
+		photo.author.photos_count += 1
 		db.session.add(photo)
 	db.session.commit()
 
@@ -71,5 +74,6 @@ def fake_collect(count=50):
 def fake_comment(count=100):
 	for i in range(count):
 		comment = Comment(author=User.query.get(random.randint(1, User.query.count())), body=fake.sentence(), timestamp=fake.date_time_this_year(), photo=Photo.query.get(random.randint(1, Photo.query.count())))
+		comment.photo.comments_count += 1
 		db.session.add(comment)
 	db.session.commit()
@@ -1,10 +1,15 @@
 import os
+import time
+import uuid
+from collections import OrderedDict
 from datetime import datetime
+from threading import Lock
 from flask import current_app
 from flask_avatars import Identicon
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 
+from albumy.cache import cache, make_key
 from albumy.extensions import db, whooshee
 
 roles_permissions = db.Table('roles_permissions', db.Column('role_id', db.Integer, db.ForeignKey('role.id')), db.Column('permission_id', db.Integer, db.ForeignKey('permission.id')))
@@ -36,27 +41,51 @@ class Role(db.Model):
 				db.session.add(role)
 			role.permissions = []
 			for permission_name in roles_permissions_map[role_name]:
-				perission = Permission.query.filter_by(name=permission_name).first()
+				permission = Permission.query.filter_by(name=permission_name).first()
 				if permission is None:
-					permission = Permission(name=permiassion_name)
+					permission = Permission(name=permission_name)
 					db.session.add(permission)
 				role.permissions.append(permission)
 		db.session.commit()
+		clear_permission_cache()
+
+permission_cache = None
+
+def load_permission_cache():
+	role_permissions = {}
+	for role_id, name in db.session.query(roles_permissions.c.role_id, Permission.name).join(Permission, Permission.id == roles_permissions.c.permission_id):
+		role_permissions.setdefault(role_id, set()).add(name)
+	expires = time.time() + current_app.config['ALBUMY_PERMISSION_CACHE_TTL']
+	return expires, dict((role_id, frozenset(names)) for role_id, names in role_permissions.items())
+
+def get_role_permissions(role_id):
+	global permission_cache
+	if permission_cache is None or permission_cache[0] < time.time():
+		permission_cache = load_permission_cache()
+	return permission_cache[1].get(role_id, frozenset())
+
+def clear_permission_cache():
+	global permission_cache
+	permission_cache = None
 
 class Follow(db.Model):
 	follower_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
 	followed_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
 	timestamp = db.Column(db.DateTime, default=datetime.utcnow)
-	follower = db.relationship('User', foreign_keys=[follower_id], back_populates='following', lazy='joined')
-	followed = db.relationship('User', foreign_keys=[followed_id], back_populates='followers', lazy='joined')
+	follower = db.relationship('User', foreign_keys=[follower_id], back_populates='following')
+	followed = db.relationship('User', foreign_keys=[followed_id], back_populates='followers')
+
+	__table_args__ = (db.Index('ix_follow_followed_timestamp', 'followed_id', 'timestamp', 'follower_id'), db.Index('ix_follow_follower_timestamp', 'follower_id', 'timestamp', 'followed_id'))
 
 class Collect(db.Model):
 	collector_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
 	collected_id = db.Column(db.Integer, db.ForeignKey('photo.id'), primary_key=True)
 	timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
-	collector = db.relationship('User', back_populates='collections', lazy='joined')
-	collected = db.relationship('Photo', back_populates='collectors', lazy='joined')
+	collector = db.relationship('User', back_populates='collections')
+	collected = db.relationship('Photo', back_populates='collectors')
+
+	__table_args__ = (db.Index('ix_collect_collected_timestamp', 'collected_id', 'timestamp', 'collector_id'), db.Index('ix_collect_collector_timestamp', 'collector_id', 'timestamp', 'collected_id'))
 
 @whooshee.register_model('name', 'username')
 class User(db.Model, UserMixin):
@@ -83,12 +112,18 @@ class User(db.Model, UserMixin):
 	receive_follow_notification = db.Column(db.Boolean, default=True)
 	receive_collect_notification = db.Column(db.Boolean, default=True)
 
+	photos_count = db.Column(db.Integer, default=0)
+	collections_count = db.Column(db.Integer, default=0)
+	followers_count = db.Column(db.Integer, default=0)
+	following_count = db.Column(db.Integer, default=0)
+	unread_notifications_count = db.Column(db.Integer, default=0)
+
 	role_id = db.Column(db.Integer, db.ForeignKey('role.id'))
 
 	role = db.relationship('Role', back_populates='users')
 	photos = db.relationship('Photo', back_populates='author', cascade='all')
 	comments = db.relationship('Comment', back_populates='author', cascade='all')
-	notifications = db.relationship('Notification', back_populates='receiver', cascade='all')
+	notifications = db.relationship('Notification', foreign_keys='Notification.receiver_id', back_populates='receiver', cascade='all')
 	collections = db.relationship('Collect', back_populates='collector', cascade='all')
 	following = db.relationship('Follow', foreign_keys=[Follow.follower_id], back_populates='follower', lazy='dynamic', cascade='all')
 	followers = db.relationship('Follow', foreign_keys=[Follow.followed_id], back_populates='followed', lazy='dynamic', cascade='all')
@@ -114,25 +149,56 @@ class User(db.Model, UserMixin):
 		return check_password_hash(self.password_hash, password)
 
 	def follow(self, user):
+		from albumy.timeline import backfill_timeline
 		if not self.is_following(user):
 			follow = Follow(follower=self, followed=user)
 			db.session.add(follow)
+			if user is not self:
+				backfill_timeline(self, user)
+				self.following_count = User.following_count + 1
+				user.followers_count = User.followers_count + 1
 			db.session.commit()
+		self.forget_follow_status(user)
 
 	def unfollow(self, user):
+		from albumy.timeline import prune_timeline
 		follow = self.following.filter_by(followed_id=user.id).first()
 		if follow:
 			db.session.delete(follow)
+			if user is not self:
+				prune_timeline(self, user)
+				self.following_count = User.following_count - 1
+				user.followers_count = User.followers_count - 1
 			db.session.commit()
+		self.forget_follow_status(user)
 
 	def is_following(self, user):
 		if user.id is None:
 			return False
+		status = getattr(self, 'follow_status', {}).get(user.id)
+		if status is not None:
+			return status[0]
 		return self.following.filter_by(followed_id=user.id).first() is not None
 
 	def is_followed_by(self, user):
+		status = getattr(self, 'follow_status', {}).get(user.id)
+		if status is not None:
+			return status[1]
 		return self.followers.filter_by(follower_id=user.id).first() is not None
 
+	def load_follow_status(self, users):
+		ids = [user.id for user in users if user.id is not None]
+		if not ids:
+			return
+		following = set(row[0] for row in db.session.query(Follow.followed_id).filter(Follow.follower_id == self.id, Follow.followed_id.in_(ids)))
+		followers = set(row[0] for row in db.session.query(Follow.follower_id).filter(Follow.followed_id == self.id, Follow.follower_id.in_(ids)))
+		self.follow_status = getattr(self, 'follow_status', {})
+		self.follow_status.update((id, (id in following, id in followers)) for id in ids)
+
+	def forget_follow_status(self, user):
+		getattr(self, 'follow_status', {}).pop(user.id, None)
+		getattr(user, 'follow_status', {}).pop(self.id, None)
+
 	@property
 	def followed_photos(self):
 		return Photo.query.join(Follow, Follow.followed_id == Photo.author_id).filter(Follow.follower_id == self.id)
@@ -141,17 +207,34 @@ class User(db.Model, UserMixin):
 		if not self.is_collecting(photo):
 			collect = Collect(collector=self, collected=photo)
 			db.session.add(collect)
+			self.collections_count = User.collections_count + 1
+			photo.collectors_count = Photo.collectors_count + 1
 			db.session.commit()
+		getattr(self, 'collect_status', {}).pop(photo.id, None)
 
 	def uncollect(self, photo):
 		collect = Collect.query.filter_by(collector_id=self.id).filter_by(collected_id=photo.id).first()
 		if collect:
 			db.session.delete(collect)
+			self.collections_count = User.collections_count - 1
+			photo.collectors_count = Photo.collectors_count - 1
 			db.session.commit()
+		getattr(self, 'collect_status', {}).pop(photo.id, None)
 
 	def is_collecting(self, photo):
+		status = getattr(self, 'collect_status', {}).get(photo.id)
+		if status is not None:
+			return status
 		return Collect.query.with_parent(self).filter_by(collected_id=photo.id).first() is not None
 
+	def load_collect_status(self, photos):
+		ids = [photo.id for photo in photos]
+		if not ids:
+			return
+		collected = set(row[0] for row in db.session.query(Collect.collected_id).filter(Collect.collector_id == self.id, Collect.collected_id.in_(ids)))
+		self.collect_status = getattr(self, 'collect_status', {})
+		self.collect_status.update((id, id in collected) for id in ids)
+
 	def lock(self):
 		self.locked = True
 		self.role = Role.query.filter_by(name='Locked').first()
@@ -180,17 +263,16 @@ class User(db.Model, UserMixin):
 
 	@property
 	def is_admin(self):
-		return self.role.name == 'Administrator'
+		return self.can('ADMINISTER')
 
 	@property
 	def is_active(self):
 		return self.active
 
 	def can(self, permission_name):
-		permission = Permission.query.filter_by(name=permission_name).first()
-		return permission is not None and self.role is not None and permission in self.role.permissions
+		return self.role_id is not None and permission_name in get_role_permissions(self.role_id)
 
-tagging = db.Table('tagging', db.Column('photo_id', db.Integer, db.ForeignKey('photo.id')), db.Column('tag_id', db.Integer, db.ForeignKey('tag.id')))
+tagging = db.Table('tagging', db.Column('photo_id', db.Integer, db.ForeignKey('photo.id'), primary_key=True), db.Column('tag_id', db.Integer, db.ForeignKey('tag.id'), primary_key=True), db.Index('ix_tagging_tag_photo', 'tag_id', 'photo_id'))
 
 @whooshee.register_model('description')
 class Photo(db.Model):
@@ -202,6 +284,9 @@ class Photo(db.Model):
 	timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 	can_comment = db.Column(db.Boolean, default=True)
 	flag = db.Column(db.Integer, default=0)
+	processing = db.Column(db.Boolean, default=False)
+	collectors_count = db.Column(db.Integer, default=0)
+	comments_count = db.Column(db.Integer, default=0)
 	author_id = db.Column(db.Integer, db.ForeignKey('user.id'))
 
 	author = db.relationship('User', back_populates='photos')
@@ -209,10 +294,14 @@ class Photo(db.Model):
 	collectors = db.relationship('Collect', back_populates='collected', cascade='all')
 	tags = db.relationship('Tag', secondary=tagging, back_populates='photos')
 
+	__table_args__ = (db.Index('ix_photo_author_timestamp', 'author_id', 'timestamp', 'id'), db.Index('ix_photo_flag', 'flag', 'id'))
+
 @whooshee.register_model('name')
 class Tag(db.Model):
 	id = db.Column(db.Integer, primary_key=True)
 	name = db.Column(db.String(64), index=True, unique=True)
+	photos_count = db.Column(db.Integer, default=0, index=True)
+	trending_score = db.Column(db.Float, index=True)
 	photos = db.relationship('Photo', secondary=tagging, back_populates='tags')
 
 class Comment(db.Model):
@@ -221,8 +310,8 @@ class Comment(db.Model):
 	timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 	flag = db.Column(db.Integer, default=0)
 
-	replied_id = db.Column(db.Integer, db.ForeignKey('comment.id'))
-	author_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+	replied_id = db.Column(db.Integer, db.ForeignKey('comment.id'), index=True)
+	author_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
 	photo_id = db.Column(db.Integer, db.ForeignKey('photo.id'))
 
 	replies = db.relationship('Comment', back_populates='replied', cascade='all')
@@ -230,14 +319,58 @@ class Comment(db.Model):
 	photo = db.relationship('Photo', back_populates='comments')
 	author = db.relationship('User', back_populates='comments')
 
+	__table_args__ = (db.Index('ix_comment_photo_timestamp', 'photo_id', 'timestamp', 'id'), db.Index('ix_comment_flag', 'flag', 'id'))
+
 class Notification(db.Model):
 	id = db.Column(db.Integer, primary_key=True)
-	message = db.Column(db.Text, nullable=False)
+	message = db.Column(db.Text)
+	type = db.Column(db.String(20))
+	target_id = db.Column(db.Integer)
+	count = db.Column(db.Integer, default=1)
 	is_read = db.Column(db.Boolean, default=False)
 	timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
 	receiver_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-	receiver = db.relationship('User', back_populates='notifications')
+	actor_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+	receiver = db.relationship('User', foreign_keys=[receiver_id], back_populates='notifications')
+	actor = db.relationship('User', foreign_keys=[actor_id])
+
+	__table_args__ = (db.Index('ix_notification_receiver_read_timestamp', 'receiver_id', 'is_read', 'timestamp'), db.Index('ix_notification_receiver_timestamp', 'receiver_id', 'timestamp', 'id'))
+
+class ArchivedNotification(db.Model):
+	id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+	message = db.Column(db.Text)
+	type = db.Column(db.String(20))
+	target_id = db.Column(db.Integer)
+	count = db.Column(db.Integer)
+	timestamp = db.Column(db.DateTime)
+
+	receiver_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+	actor_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+
+class Timeline(db.Model):
+	user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+	photo_id = db.Column(db.Integer, db.ForeignKey('photo.id'), primary_key=True)
+	author_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
+	timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+	__table_args__ = (db.Index('ix_timeline_user_timestamp', 'user_id', 'timestamp', 'photo_id'),)
+
+def rebuild_counters():
+	collectors = db.select([db.func.count(Collect.collector_id)]).where(Collect.collected_id == Photo.id).as_scalar()
+	comments = db.select([db.func.count(Comment.id)]).where(Comment.photo_id == Photo.id).as_scalar()
+	Photo.query.update({Photo.collectors_count: collectors, Photo.comments_count: comments}, synchronize_session=False)
+
+	photos = db.select([db.func.count(Photo.id)]).where(Photo.author_id == User.id).as_scalar()
+	collections = db.select([db.func.count(Collect.collected_id)]).where(Collect.collector_id == User.id).as_scalar()
+	followers = db.select([db.func.count(Follow.follower_id)]).where(Follow.followed_id == User.id).where(Follow.follower_id != User.id).as_scalar()
+	following = db.select([db.func.count(Follow.followed_id)]).where(Follow.follower_id == User.id).where(Follow.followed_id != User.id).as_scalar()
+	unread = db.select([db.func.count(Notification.id)]).where(Notification.receiver_id == User.id).where(Notification.is_read == False).as_scalar()
+	User.query.update({User.photos_count: photos, User.collections_count: collections, User.followers_count: followers, User.following_count: following, User.unread_notifications_count: unread}, synchronize_session=False)
+
+	tagged = db.select([db.func.count(tagging.c.photo_id)]).where(tagging.c.tag_id == Tag.id).as_scalar()
+	Tag.query.update({Tag.photos_count: tagged}, synchronize_session=False)
+	db.session.commit()
 
 @db.event.listens_for(User, 'after_delete', named=True)
 def delete_avatars(**kwargs):
@@ -248,10 +381,114 @@ def delete_avatars(**kwargs):
 			if os.path.exists(path):
 				os.remove(path)
 
+@db.event.listens_for(User, 'after_delete', named=True)
+def delete_timeline(**kwargs):
+	target = kwargs['target']
+	kwargs['connection'].execute(Timeline.__table__.delete().where(Timeline.user_id == target.id))
+
+@db.event.listens_for(User, 'after_delete', named=True)
+def delete_archived_notifications(**kwargs):
+	target = kwargs['target']
+	kwargs['connection'].execute(ArchivedNotification.__table__.delete().where(ArchivedNotification.receiver_id == target.id))
+
+@db.event.listens_for(User, 'after_delete', named=True)
+def clear_notification_actor(**kwargs):
+	target = kwargs['target']
+	kwargs['connection'].execute(Notification.__table__.update().where(Notification.actor_id == target.id).values(actor_id=None))
+	kwargs['connection'].execute(ArchivedNotification.__table__.update().where(ArchivedNotification.actor_id == target.id).values(actor_id=None))
+
 @db.event.listens_for(Photo, 'after_delete', named=True)
-def delete_photos(**kwargs):
+def delete_timeline_entries(**kwargs):
 	target = kwargs['target']
-	for filename in [target.filename, target.filename_s, target.filename_m]:
+	kwargs['connection'].execute(Timeline.__table__.delete().where(Timeline.photo_id == target.id))
+
+def delete_photo_files(filename, filename_s, filename_m):
+	filenames = [filename, filename_s, filename_m]
+	for resized in [filename_s, filename_m]:
+		if resized != filename:
+			base = os.path.splitext(resized)[0]
+			filenames.extend(base + '.' + ext for ext, quality in current_app.config['ALBUMY_PHOTO_FORMATS'])
+	base = os.path.splitext(filename)[0]
+	for width in current_app.config['ALBUMY_THUMBNAIL_WIDTHS']:
+		directory = os.path.join(current_app.config['ALBUMY_THUMBNAIL_PATH'], str(width))
+		filenames.append(os.path.join(directory, filename))
+		filenames.extend(os.path.join(directory, base + '.' + ext) for ext, quality in current_app.config['ALBUMY_PHOTO_FORMATS'])
+	for filename in filenames:
 		path = os.path.join(current_app.config['ALBUMY_UPLOAD_PATH'], filename)
 		if os.path.exists(path):
 			os.remove(path)
+
+@db.event.listens_for(Photo, 'after_delete', named=True)
+def delete_photos(**kwargs):
+	target = kwargs['target']
+	delete_photo_files(target.filename, target.filename_s, target.filename_m)
+
+@db.event.listens_for(Role.permissions, 'append', named=True)
+@db.event.listens_for(Role.permissions, 'remove', named=True)
+@db.event.listens_for(Role, 'after_delete', named=True)
+@db.event.listens_for(Permission, 'after_delete', named=True)
+def expire_permissions(**kwargs):
+	clear_permission_cache()
+
+USER_COUNTERS = ('photos_count', 'collections_count', 'followers_count', 'following_count', 'unread_notifications_count')
+
+session_users = OrderedDict()
+session_users_lock = Lock()
+
+def load_session_user(user_id):
+	session = db.create_session({})()
+	try:
+		return session.query(User).options(db.joinedload(User.role).joinedload(Role.permissions)).get(user_id)
+	finally:
+		session.close()
+
+def get_session_user(user_id):
+	ttl = current_app.config['ALBUMY_USER_CACHE_TTL']
+	if not ttl:
+		return User.query.options(db.joinedload(User.role)).get(user_id)
+	version = cache.backend.get(make_key('user-version', user_id))
+	with session_users_lock:
+		entry = session_users.get(user_id)
+		if entry is not None and entry[0] == version and entry[1] > time.time():
+			session_users.move_to_end(user_id)
+			user = entry[2]
+		else:
+			user = None
+	if user is None:
+		user = load_session_user(user_id)
+		if user is None:
+			return None
+		with session_users_lock:
+			session_users[user_id] = (version, time.time() + ttl, user)
+			while len(session_users) > current_app.config['ALBUMY_USER_CACHE_SIZE']:
+				session_users.popitem(last=False)
+	user = db.session.merge(user, load=False)
+	db.session.expire(user, USER_COUNTERS)
+	return user
+
+def expire_session_user(user_id):
+	with session_users_lock:
+		session_users.pop(user_id, None)
+	cache.backend.set(make_key('user-version', user_id), uuid.uuid4().hex, current_app.config['ALBUMY_USER_CACHE_TTL'])
+
+@db.event.listens_for(User, 'after_update', named=True)
+def collect_updated_user(**kwargs):
+	target = kwargs['target']
+	state = db.inspect(target)
+	keys = [attr.key for attr in kwargs['mapper'].column_attrs if attr.key not in USER_COUNTERS] + ['role']
+	if any(state.attrs[key].history.has_changes() for key in keys):
+		state.session.info.setdefault('expired_users', set()).add(target.id)
+
+@db.event.listens_for(User, 'after_delete', named=True)
+def collect_deleted_user(**kwargs):
+	target = kwargs['target']
+	db.inspect(target).session.info.setdefault('expired_users', set()).add(target.id)
+
+@db.event.listens_for(db.session, 'after_commit')
+def expire_session_users(session):
+	for user_id in session.info.pop('expired_users', ()):
+		expire_session_user(user_id)
+
+@db.event.listens_for(db.session, 'after_rollback')
+def discard_session_users(session):
+	session.info.pop('expired_users', None)
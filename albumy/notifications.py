@@ -1,21 +1,116 @@
-from flask import url_for
+import atexit
+import time
+from datetime import datetime
+from queue import Queue, Empty
+from threading import Lock, Thread
+
+from flask import current_app
 from albumy.extensions import db
-from albumy.models import Notification
+from albumy.models import User, Notification, ArchivedNotification
 
-def push_follow_notification(follower, receiver):
-	message = 'User <a href="%s">%s</a> followed you.' % (url_for('user.index', username=follower.username), follower.username)
-	notification = Notification(message=message, receiver=receiver)
-	db.session.add(notification)
-	db.session.commit()
+events = Queue()
+worker = None
+worker_lock = Lock()
+
+def start_worker(app):
+	global worker
+	with worker_lock:
+		if worker is None:
+			worker = Thread(target=_deliver_forever, args=[app], daemon=True)
+			worker.start()
+			atexit.register(_deliver_pending, app)
+
+def _deliver_batch(app, batch):
+	with app.app_context():
+		try:
+			deliver_notifications(batch)
+		except Exception:
+			db.session.rollback()
+			app.logger.exception('Failed to deliver %d notifications.', len(batch))
+
+def _deliver_forever(app):
+	while True:
+		batch = [events.get()]
+		deadline = time.time() + app.config['ALBUMY_NOTIFICATION_DELAY']
+		while len(batch) < app.config['ALBUMY_NOTIFICATION_BATCH_SIZE']:
+			timeout = deadline - time.time()
+			if timeout <= 0:
+				break
+			try:
+				batch.append(events.get(timeout=timeout))
+			except Empty:
+				break
+		_deliver_batch(app, batch)
+
+def _deliver_pending(app):
+	batch = []
+	while True:
+		try:
+			batch.append(events.get_nowait())
+		except Empty:
+			break
+	if batch:
+		_deliver_batch(app, batch)
 
-def push_comment_notification(photo_id, receiver, page=1):
-	message = '<a href="%s#comments">This photo</a> has new comment/reply.' % (url_for('main.show_photo', photo_id=photo_id, page=page))
-	notification = Notification(message=message, receiver=receiver)
-	db.session.add(notification)
+def deliver_notifications(batch):
+	groups = {}
+	for type, receiver_id, actor_id, target_id, timestamp in batch:
+		key = (receiver_id, type, target_id)
+		count = groups[key][0] if key in groups else 0
+		groups[key] = (count + 1, actor_id, timestamp)
+
+	unread = {}
+	for (receiver_id, type, target_id), (count, actor_id, timestamp) in groups.items():
+		notifications = Notification.query.filter_by(receiver_id=receiver_id, type=type, target_id=target_id, is_read=False)
+		if not notifications.update({Notification.count: Notification.count + count, Notification.actor_id: actor_id, Notification.timestamp: timestamp}, synchronize_session=False):
+			db.session.add(Notification(type=type, receiver_id=receiver_id, actor_id=actor_id, target_id=target_id, count=count, timestamp=timestamp))
+			unread[receiver_id] = unread.get(receiver_id, 0) + 1
+	for receiver_id, count in unread.items():
+		User.query.filter_by(id=receiver_id).update({User.unread_notifications_count: User.unread_notifications_count + count}, synchronize_session=False)
 	db.session.commit()
 
+def push_notification(type, receiver, actor=None, target_id=None):
+	event = (type, receiver.id, actor.id if actor is not None else None, target_id, datetime.utcnow())
+	app = current_app._get_current_object()
+	if not app.config['ALBUMY_NOTIFICATION_DELAY']:
+		deliver_notifications([event])
+	else:
+		start_worker(app)
+		events.put(event)
+
+def push_follow_notification(follower, receiver):
+	push_notification('follow', receiver, actor=follower)
+
+def push_comment_notification(commenter, photo_id, receiver):
+	push_notification('comment', receiver, actor=commenter, target_id=photo_id)
+
 def push_collect_notification(collector, photo_id, receiver):
-	message = 'User <a href="%s">%s</a> collected your <a href="%s">photo</a>' % (url_for('user.index', username=collector.username), collector.username, url_for('main.show_photo', photo_id=photo_id))
-	notification = Notification(message=message, receiver=receiver)
-	db.session.add(notification)
+	push_notification('collect', receiver, actor=collector, target_id=photo_id)
+
+def read_notifications(receiver, max_id=None, type=None, notification_id=None):
+	notifications = Notification.query.filter_by(receiver_id=receiver.id, is_read=False)
+	if max_id is not None:
+		notifications = notifications.filter(Notification.id <= max_id)
+	if type is not None:
+		notifications = notifications.filter_by(type=type)
+	if notification_id is not None:
+		notifications = notifications.filter_by(id=notification_id)
+	count = notifications.update({Notification.is_read: True}, synchronize_session=False)
+	if count:
+		unread = db.case([(User.unread_notifications_count > count, User.unread_notifications_count - count)], else_=0)
+		User.query.filter_by(id=receiver.id).update({User.unread_notifications_count: unread}, synchronize_session=False)
 	db.session.commit()
+	return count
+
+def archive_notifications(before, batch_size=1000):
+	count = 0
+	columns = ['id', 'message', 'type', 'target_id', 'count', 'timestamp', 'receiver_id', 'actor_id']
+	while True:
+		ids = [id for id, in db.session.query(Notification.id).filter(Notification.is_read == True, Notification.timestamp < before).order_by(Notification.id).limit(batch_size)]
+		if not ids:
+			return count
+		notifications = db.select([getattr(Notification, column) for column in columns]).where(Notification.id.in_(ids))
+		db.session.execute(ArchivedNotification.__table__.insert().from_select(columns, notifications))
+		Notification.query.filter(Notification.id.in_(ids)).delete(synchronize_session=False)
+		db.session.commit()
+		count += len(ids)
@@ -0,0 +1,76 @@
+from datetime import datetime
+
+from albumy.extensions import db
+
+CURSOR_FORMAT = '%Y%m%d%H%M%S%f'
+LAST_PAGE = 'last'
+
+def encode_cursor(direction, key):
+	value, id = key
+	if isinstance(value, datetime):
+		value = value.strftime(CURSOR_FORMAT)
+	return '%s%s-%d' % (direction, value, id)
+
+def decode_cursor(cursor, value_type=datetime):
+	if cursor == LAST_PAGE:
+		return 'p', None
+	try:
+		direction = cursor[0]
+		value, id = cursor[1:].rsplit('-', 1)
+		if direction not in ('n', 'p'):
+			return None, None
+		if value_type is datetime:
+			value = datetime.strptime(value, CURSOR_FORMAT)
+		else:
+			value = value_type(value)
+		return direction, (value, int(id))
+	except (TypeError, ValueError, IndexError):
+		return None, None
+
+def keyset_filter(column, id_column, key, direction, descending=True):
+	value, id = key
+	if (direction == 'n') == descending:
+		return db.or_(column < value, db.and_(column == value, id_column < id))
+	return db.or_(column > value, db.and_(column == value, id_column > id))
+
+def keyset_order(column, id_column, direction, descending=True):
+	if (direction == 'p') == descending:
+		return column.asc(), id_column.asc()
+	return column.desc(), id_column.desc()
+
+def paginate_keyset(query, column, id_column, cursor, per_page, descending=True):
+	value_type = datetime if isinstance(column.type, db.DateTime) else int
+	direction, key = decode_cursor(cursor, value_type)
+	if key is not None:
+		query = query.filter(keyset_filter(column, id_column, key, direction, descending))
+	rows = query.order_by(*keyset_order(column, id_column, direction, descending)).limit(per_page + 1).all()
+	return KeysetPagination.from_rows(rows, lambda item: (getattr(item, column.key), getattr(item, id_column.key)), direction, key is not None, per_page)
+
+class KeysetPagination(object):
+	page = None
+
+	def __init__(self, items, key, has_prev, has_next):
+		self.items = items
+		self.key = key
+		self.has_prev = has_prev and bool(items)
+		self.has_next = has_next and bool(items)
+
+	@property
+	def prev_num(self):
+		return encode_cursor('p', self.key(self.items[0]))
+
+	@property
+	def next_num(self):
+		return encode_cursor('n', self.key(self.items[-1]))
+
+	def iter_pages(self, *args, **kwargs):
+		return iter(())
+
+	@classmethod
+	def from_rows(cls, rows, key, direction, has_cursor, per_page):
+		has_more = len(rows) > per_page
+		rows = rows[:per_page]
+		if direction == 'p':
+			rows.reverse()
+			return cls(rows, key, has_prev=has_more, has_next=has_cursor)
+		return cls(rows, key, has_prev=has_cursor, has_next=has_more)
@@ -0,0 +1,49 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from flask import current_app
+
+from albumy.extensions import db
+from albumy.models import Photo, delete_photo_files
+from albumy.utils import resize_images
+
+executor = None
+executor_lock = Lock()
+
+def get_executor(app):
+	global executor
+	with executor_lock:
+		if executor is None:
+			executor = ThreadPoolExecutor(max_workers=app.config['ALBUMY_PHOTO_WORKERS'])
+	return executor
+
+def generate_thumbnails(photo_id):
+	photo = Photo.query.get(photo_id)
+	if photo is None:
+		return
+	filename = photo.filename
+	path = os.path.join(current_app.config['ALBUMY_UPLOAD_PATH'], filename)
+	values = {Photo.processing: False}
+	try:
+		sizes = current_app.config['ALBUMY_PHOTO_SIZE']
+		values[Photo.filename_s], values[Photo.filename_m] = resize_images(path, filename, [sizes['small'], sizes['medium']])
+	except Exception:
+		current_app.logger.exception('Failed to resize photo %d, serving the original.', photo_id)
+	finally:
+		db.session.rollback()
+		updated = Photo.query.filter_by(id=photo_id).update(values, synchronize_session=False)
+		db.session.commit()
+		if not updated and Photo.filename_s in values:
+			delete_photo_files(filename, values[Photo.filename_s], values[Photo.filename_m])
+
+def _generate_thumbnails_async(app, photo_id):
+	with app.app_context():
+		generate_thumbnails(photo_id)
+
+def process_photo(photo):
+	app = current_app._get_current_object()
+	if not app.config['ALBUMY_PHOTO_WORKERS']:
+		generate_thumbnails(photo.id)
+	else:
+		get_executor(app).submit(_generate_thumbnails_async, app, photo.id)
@@ -0,0 +1,169 @@
+import bisect
+import logging
+import re
+import time
+from collections import deque
+from logging.handlers import RotatingFileHandler
+from threading import Lock
+
+from flask import current_app, g, has_app_context, has_request_context, request, request_started, request_finished, before_render_template, template_rendered
+
+from albumy.extensions import db
+
+HISTOGRAM_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+SLOW_QUERY_STATEMENTS = 200
+
+slow_query_logger = logging.getLogger('albumy.slow_queries')
+
+class QueryBudgetExceeded(RuntimeError):
+	pass
+
+def normalize_sql(statement):
+	statement = re.sub(r"'(?:[^']|'')*'", '?', statement)
+	statement = re.sub(r'\b\d+(?:\.\d+)?\b', '?', statement)
+	statement = re.sub(r'\(\s*\?(?:\s*,\s*\?)+\s*\)', '(?, ...)', statement)
+	return re.sub(r'\s+', ' ', statement).strip()
+
+def percentile(samples, fraction):
+	if not samples:
+		return 0
+	return samples[min(int(len(samples) * fraction), len(samples) - 1)]
+
+class EndpointStats(object):
+	def __init__(self, window):
+		self.count = 0
+		self.histogram = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+		self.samples = deque(maxlen=window)
+
+	def add(self, total, query_time, template_time, query_count):
+		self.count += 1
+		self.histogram[bisect.bisect_left(HISTOGRAM_BUCKETS, total)] += 1
+		self.samples.append((total, query_time, template_time, query_count))
+
+	def summary(self, endpoint):
+		totals, query_times, template_times, query_counts = [sorted(column) for column in zip(*self.samples)]
+		return dict(endpoint=endpoint, count=self.count, histogram=self.histogram,
+			p50=percentile(totals, 0.5), p95=percentile(totals, 0.95), p99=percentile(totals, 0.99),
+			db_p95=percentile(query_times, 0.95), template_p95=percentile(template_times, 0.95),
+			queries=sum(query_counts) / len(query_counts), queries_max=query_counts[-1], spent=sum(totals))
+
+class Profiler(object):
+	def __init__(self):
+		self.lock = Lock()
+		self.endpoints = {}
+		self.slow_queries = {}
+		self.enabled = False
+
+	def init_app(self, app):
+		budget = app.config['ALBUMY_QUERY_BUDGET'] is not None
+		if not budget and not app.config['ALBUMY_PROFILING']:
+			return
+		with app.app_context():
+			engine = db.engine
+		db.event.listen(engine, 'before_cursor_execute', count_query)
+		app.before_request(reset_request_stats)
+		if budget:
+			app.after_request(check_query_budget)
+		if app.config['ALBUMY_PROFILING']:
+			self.enabled = True
+			self.window = app.config['ALBUMY_PROFILING_WINDOW']
+			self.slow_query_threshold = app.config['ALBUMY_SLOW_QUERY_THRESHOLD']
+			if app.config['ALBUMY_SLOW_QUERY_LOG'] and not slow_query_logger.handlers:
+				handler = RotatingFileHandler(app.config['ALBUMY_SLOW_QUERY_LOG'], maxBytes=10 * 1024 * 1024, backupCount=5)
+				handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+				slow_query_logger.addHandler(handler)
+				slow_query_logger.setLevel(logging.INFO)
+			db.event.listen(engine, 'before_cursor_execute', start_query)
+			db.event.listen(engine, 'after_cursor_execute', finish_query)
+			request_started.connect(start_request, app)
+			request_finished.connect(finish_request, app)
+			before_render_template.connect(start_template, app)
+			template_rendered.connect(finish_template, app)
+
+	def record(self, endpoint, total, query_time, template_time, query_count):
+		with self.lock:
+			stats = self.endpoints.get(endpoint)
+			if stats is None:
+				stats = self.endpoints[endpoint] = EndpointStats(self.window)
+			stats.add(total, query_time, template_time, query_count)
+
+	def record_slow_query(self, statement, duration):
+		statement = normalize_sql(statement)
+		endpoint = request.endpoint if has_request_context() else None
+		slow_query_logger.info('%.1f ms %s %s', duration, endpoint or '-', statement)
+		with self.lock:
+			entry = self.slow_queries.get(statement)
+			if entry is None:
+				if len(self.slow_queries) >= SLOW_QUERY_STATEMENTS:
+					return
+				entry = self.slow_queries[statement] = dict(statement=statement, count=0, total=0.0, max=0.0, endpoint=endpoint)
+			entry['count'] += 1
+			entry['total'] += duration
+			entry['max'] = max(entry['max'], duration)
+
+	def report(self):
+		with self.lock:
+			endpoints = [stats.summary(endpoint) for endpoint, stats in self.endpoints.items()]
+			slow_queries = [dict(entry) for entry in self.slow_queries.values()]
+		endpoints.sort(key=lambda stats: stats['spent'], reverse=True)
+		slow_queries.sort(key=lambda entry: entry['total'], reverse=True)
+		return endpoints, slow_queries
+
+	def reset(self):
+		with self.lock:
+			self.endpoints.clear()
+			self.slow_queries.clear()
+
+profiler = Profiler()
+
+def count_query(connection, cursor, statement, parameters, context, executemany):
+	if has_request_context():
+		g.query_count = g.get('query_count', 0) + 1
+
+def start_query(connection, cursor, statement, parameters, context, executemany):
+	connection.info.setdefault('query_start', []).append(time.perf_counter())
+
+def finish_query(connection, cursor, statement, parameters, context, executemany):
+	duration = (time.perf_counter() - connection.info['query_start'].pop()) * 1000
+	if has_request_context():
+		g.query_time = g.get('query_time', 0) + duration
+	if has_app_context() and duration >= profiler.slow_query_threshold:
+		profiler.record_slow_query(statement, duration)
+
+def reset_request_stats():
+	g.query_count = 0
+	g.query_time = 0
+	g.query_budget = current_app.config['ALBUMY_QUERY_BUDGET']
+
+def check_query_budget(response):
+	budget = g.get('query_budget')
+	count = g.get('query_count', 0)
+	if budget is not None and count > budget:
+		message = '%s %s ran %d queries, over its budget of %d.' % (request.method, request.endpoint, count, budget)
+		if current_app.testing:
+			raise QueryBudgetExceeded(message)
+		current_app.logger.warning(message)
+	return response
+
+def start_request(sender, **extra):
+	g.request_start = time.perf_counter()
+	g.template_time = 0
+	g.template_start = []
+
+def finish_request(sender, response, **extra):
+	if 'request_start' not in g or request.endpoint in (None, 'static'):
+		return
+	total = (time.perf_counter() - g.request_start) * 1000
+	query_time, template_time, query_count = g.get('query_time', 0), g.template_time, g.get('query_count', 0)
+	profiler.record(request.endpoint, total, query_time, template_time, query_count)
+	response.headers['Server-Timing'] = 'db;dur=%.1f;desc="%d queries", tpl;dur=%.1f, app;dur=%.1f' % (query_time, query_count, template_time, total)
+
+def start_template(sender, template, context, **extra):
+	if has_request_context() and 'template_start' in g:
+		g.template_start.append(time.perf_counter())
+
+def finish_template(sender, template, context, **extra):
+	if has_request_context() and g.get('template_start'):
+		start = g.template_start.pop()
+		if not g.template_start:
+			g.template_time += (time.perf_counter() - start) * 1000
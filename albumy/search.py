@@ -0,0 +1,298 @@
+import re
+import time
+from queue import Queue, Empty
+from threading import Lock, Thread
+
+from flask import abort, current_app
+from flask_sqlalchemy import Pagination
+from whoosh.qparser import MultifieldParser, OrGroup
+from whoosh.writing import CLEAR
+
+from albumy.cache import cache, make_key
+from albumy.extensions import db, whooshee
+from albumy.models import User, Photo, Tag
+
+SEARCH_FIELDS = {User: ('name', 'username'), Photo: ('description',), Tag: ('name',)}
+SEARCH_MODELS = dict((model.__tablename__, model) for model in SEARCH_FIELDS)
+
+def document(fields, values):
+	return dict((field, str(value) if value is not None else '') for field, value in zip(fields, values))
+
+def search_terms(q):
+	return re.findall(r'\w+', q, re.UNICODE)
+
+class WhooshBackend(object):
+	def __init__(self, app):
+		self.app = app
+
+	def get_index(self, model):
+		return whooshee.get_or_create_index(self.app, model._whoosheer_)
+
+	def index(self, model, documents):
+		writer = self.get_index(model).writer(timeout=self.app.config['WHOOSHEE_WRITER_TIMEOUT'])
+		for id, document in documents.items():
+			if document is None:
+				writer.delete_by_term('id', id)
+			else:
+				writer.update_document(id=id, **document)
+		writer.commit(merge=True)
+
+	def optimize(self, model):
+		self.get_index(model).optimize()
+
+	def clear(self, model):
+		writer = self.get_index(model).writer(timeout=self.app.config['WHOOSHEE_WRITER_TIMEOUT'])
+		writer.commit(mergetype=CLEAR)
+
+	def parse(self, model, q):
+		substring_length = self.app.config['ALBUMY_SEARCH_SUBSTRING_MIN']
+		terms = ['*%s*' % term if len(term) >= substring_length else term + '*' for term in search_terms(q)]
+		if not terms:
+			return None
+		schema = model._whoosheer_.schema
+		return MultifieldParser(SEARCH_FIELDS[model], schema, group=OrGroup).parse(' '.join(terms))
+
+	def search(self, model, q, page, per_page):
+		query = self.parse(model, q)
+		if query is None:
+			return []
+		with self.get_index(model).searcher() as searcher:
+			results = searcher.search_page(query, page, pagelen=per_page)
+			if page > results.pagecount:
+				return []
+			return [hit['id'] for hit in results]
+
+	def count(self, model, q):
+		query = self.parse(model, q)
+		if query is None:
+			return 0
+		with self.get_index(model).searcher() as searcher:
+			return len(searcher.search(query, limit=1))
+
+class SQLiteBackend(object):
+	def __init__(self, app):
+		self.app = app
+		self.created = set()
+
+	def create(self, connection, model):
+		columns = ', '.join(SEARCH_FIELDS[model])
+		connection.execute(db.text("CREATE VIRTUAL TABLE IF NOT EXISTS search_%s USING fts5(%s, tokenize='unicode61', prefix='1 2 3')" % (model.__tablename__, columns)))
+
+	def table(self, model):
+		table = 'search_' + model.__tablename__
+		if table not in self.created:
+			with db.engine.begin() as connection:
+				self.create(connection, model)
+			self.created.add(table)
+		return table
+
+	def index(self, model, documents):
+		table = self.table(model)
+		fields = SEARCH_FIELDS[model]
+		rows = [dict(document, id=id) for id, document in documents.items() if document is not None]
+		with db.engine.begin() as connection:
+			connection.execute(db.text('DELETE FROM %s WHERE rowid = :id' % table), [dict(id=id) for id in documents])
+			if rows:
+				connection.execute(db.text('INSERT INTO %s (rowid, %s) VALUES (:id, %s)' % (table, ', '.join(fields), ', '.join(':' + field for field in fields))), rows)
+
+	def optimize(self, model):
+		table = self.table(model)
+		with db.engine.begin() as connection:
+			connection.execute(db.text("INSERT INTO %s (%s) VALUES ('optimize')" % (table, table)))
+
+	def clear(self, model):
+		with db.engine.begin() as connection:
+			connection.execute(db.text('DROP TABLE IF EXISTS search_%s' % model.__tablename__))
+			self.create(connection, model)
+		self.created.add('search_' + model.__tablename__)
+
+	def match(self, q):
+		return ' OR '.join('"%s"*' % term for term in search_terms(q))
+
+	def search(self, model, q, page, per_page):
+		match = self.match(q)
+		if not match:
+			return []
+		rows = db.session.execute('SELECT rowid FROM %s WHERE %s MATCH :match ORDER BY rank LIMIT :limit OFFSET :offset' % ((self.table(model),) * 2),
+			dict(match=match, limit=per_page, offset=(page - 1) * per_page))
+		return [row[0] for row in rows]
+
+	def count(self, model, q):
+		match = self.match(q)
+		if not match:
+			return 0
+		return db.session.execute('SELECT count(*) FROM %s WHERE %s MATCH :match' % ((self.table(model),) * 2), dict(match=match)).scalar()
+
+class PostgresBackend(object):
+	def __init__(self, app):
+		self.app = app
+		self.created = set()
+
+	def table(self, model):
+		table = 'search_' + model.__tablename__
+		if table not in self.created:
+			with db.engine.begin() as connection:
+				connection.execute(db.text('CREATE TABLE IF NOT EXISTS %s (id INTEGER PRIMARY KEY, document TSVECTOR NOT NULL)' % table))
+				connection.execute(db.text('CREATE INDEX IF NOT EXISTS ix_%s_document ON %s USING GIN (document)' % (table, table)))
+			self.created.add(table)
+		return table
+
+	def index(self, model, documents):
+		table = self.table(model)
+		deleted = [dict(id=id) for id, document in documents.items() if document is None]
+		rows = [dict(id=id, text=' '.join(document.values())) for id, document in documents.items() if document is not None]
+		with db.engine.begin() as connection:
+			if deleted:
+				connection.execute(db.text('DELETE FROM %s WHERE id = :id' % table), deleted)
+			if rows:
+				connection.execute(db.text("INSERT INTO %s (id, document) VALUES (:id, to_tsvector('simple', :text)) "
+					'ON CONFLICT (id) DO UPDATE SET document = EXCLUDED.document' % table), rows)
+
+	def optimize(self, model):
+		pass
+
+	def clear(self, model):
+		table = self.table(model)
+		with db.engine.begin() as connection:
+			connection.execute(db.text('DELETE FROM %s' % table))
+
+	def match(self, q):
+		return ' | '.join('%s:*' % term for term in search_terms(q))
+
+	def search(self, model, q, page, per_page):
+		match = self.match(q)
+		if not match:
+			return []
+		rows = db.session.execute("SELECT id FROM %s WHERE document @@ to_tsquery('simple', :match) "
+			"ORDER BY ts_rank(document, to_tsquery('simple', :match)) DESC, id DESC LIMIT :limit OFFSET :offset" % self.table(model),
+			dict(match=match, limit=per_page, offset=(page - 1) * per_page))
+		return [row[0] for row in rows]
+
+	def count(self, model, q):
+		match = self.match(q)
+		if not match:
+			return 0
+		return db.session.execute("SELECT count(*) FROM %s WHERE document @@ to_tsquery('simple', :match)" % self.table(model), dict(match=match)).scalar()
+
+backends = {'whoosh': WhooshBackend, 'sqlite': SQLiteBackend, 'postgres': PostgresBackend}
+
+class SearchIndex(object):
+	def __init__(self):
+		self.queue = Queue()
+		self.worker = None
+		self.worker_lock = Lock()
+
+	def init_app(self, app):
+		app.extensions['search'] = backends[app.config['ALBUMY_SEARCH_BACKEND']](app)
+
+	@property
+	def backend(self):
+		return current_app.extensions['search']
+
+	def count(self, model, q):
+		key = make_key('search-count', model.__tablename__, ' '.join(search_terms(q.lower())))
+		return int(cache.fetch(key, lambda: self.backend.count(model, q), current_app.config['ALBUMY_SEARCH_COUNT_TTL']))
+
+	def paginate(self, model, q, page, per_page):
+		if page < 1:
+			abort(404)
+		ids = self.backend.search(model, q, page, per_page)
+		items = dict((item.id, item) for item in model.query.filter(model.id.in_(ids))) if ids else {}
+		items = [items[id] for id in ids if id in items]
+		total = self.count(model, q) if ids or page > 1 else 0
+		return Pagination(None, page, per_page, total, items)
+
+	def write(self, changes):
+		documents = {}
+		for table, id, document in changes:
+			documents.setdefault(table, {})[id] = document
+		for table, changed in documents.items():
+			self.backend.index(SEARCH_MODELS[table], changed)
+
+	def optimize(self):
+		for model in SEARCH_FIELDS:
+			self.backend.optimize(model)
+
+	def reindex(self, batch_size=1000):
+		for model in SEARCH_FIELDS:
+			self.backend.clear(model)
+			fields = SEARCH_FIELDS[model]
+			last_id = 0
+			while True:
+				rows = db.session.query(model.id, *[getattr(model, field) for field in fields]).filter(model.id > last_id).order_by(model.id).limit(batch_size).all()
+				if not rows:
+					break
+				self.backend.index(model, dict((row[0], document(fields, row[1:])) for row in rows))
+				last_id = rows[-1][0]
+			self.backend.optimize(model)
+
+	def enqueue(self, changes):
+		app = current_app._get_current_object()
+		if not app.config['ALBUMY_SEARCH_DELAY']:
+			self.write(changes)
+			return
+		with self.worker_lock:
+			if self.worker is None:
+				self.worker = Thread(target=self._index_forever, args=[app], daemon=True)
+				self.worker.start()
+		for change in changes:
+			self.queue.put(change)
+
+	def _index_forever(self, app):
+		merged = time.time()
+		written = False
+		while True:
+			try:
+				changes = [self.queue.get(timeout=app.config['ALBUMY_SEARCH_MERGE_INTERVAL'])]
+			except Empty:
+				changes = []
+			deadline = time.time() + app.config['ALBUMY_SEARCH_DELAY']
+			while changes and len(changes) < app.config['ALBUMY_SEARCH_BATCH_SIZE']:
+				timeout = deadline - time.time()
+				if timeout <= 0:
+					break
+				try:
+					changes.append(self.queue.get(timeout=timeout))
+				except Empty:
+					break
+			with app.app_context():
+				try:
+					if changes:
+						self.write(changes)
+						written = True
+					if written and time.time() - merged > app.config['ALBUMY_SEARCH_MERGE_INTERVAL']:
+						self.optimize()
+						merged = time.time()
+						written = False
+				except Exception:
+					db.session.rollback()
+					app.logger.exception('Failed to index %d search changes.', len(changes))
+
+search_index = SearchIndex()
+
+@db.event.listens_for(db.session, 'after_flush')
+def collect_search_changes(session, flush_context):
+	changes = session.info.setdefault('search_changes', [])
+	for obj in session.new:
+		if type(obj) in SEARCH_FIELDS:
+			fields = SEARCH_FIELDS[type(obj)]
+			changes.append((obj.__tablename__, obj.id, document(fields, [getattr(obj, field) for field in fields])))
+	for obj in session.dirty:
+		if type(obj) in SEARCH_FIELDS:
+			fields = SEARCH_FIELDS[type(obj)]
+			state = db.inspect(obj)
+			if any(state.attrs[field].history.has_changes() for field in fields):
+				changes.append((obj.__tablename__, obj.id, document(fields, [getattr(obj, field) for field in fields])))
+	for obj in session.deleted:
+		if type(obj) in SEARCH_FIELDS:
+			changes.append((obj.__tablename__, obj.id, None))
+
+@db.event.listens_for(db.session, 'after_commit')
+def index_search_changes(session):
+	changes = session.info.pop('search_changes', None)
+	if changes:
+		search_index.enqueue(changes)
+
+@db.event.listens_for(db.session, 'after_rollback')
+def discard_search_changes(session):
+	session.info.pop('search_changes', None)
@@ -9,6 +9,17 @@ if WIN:
 else:
 	prefix = 'sqlite:////'
 
+def database_uri(uri):
+	if uri and uri.startswith('postgres://'):
+		return 'postgresql://' + uri[len('postgres://'):]
+	return uri
+
+def engine_options(uri):
+	options = dict(pool_pre_ping=True, pool_recycle=int(os.getenv('DATABASE_POOL_RECYCLE', 30 * 60)))
+	if not uri.startswith('sqlite'):
+		options.update(pool_size=int(os.getenv('DATABASE_POOL_SIZE', 10)), max_overflow=int(os.getenv('DATABASE_MAX_OVERFLOW', 20)), pool_timeout=int(os.getenv('DATABASE_POOL_TIMEOUT', 30)))
+	return options
+
 class Operations:
 	CONFIRM = 'confirm'
 	RESET_PASSWORD = 'reset-password'
@@ -25,10 +36,64 @@ class BaseConfig:
 	ALBUMY_MANAGE_TAG_PER_PAGE = 50
 	ALBUMY_MANAGE_COMMENT_PER_PAGE = 30
 	ALBUMY_SEARCH_RESULT_PER_PAGE = 20
+	ALBUMY_TIMELINE_FANOUT_LIMIT = 10000
+	ALBUMY_TIMELINE_BACKFILL = 200
 	ALBUMY_MAIL_SUBJECT_PREFIX = '[Albumy]'
 	ALBUMY_UPLOAD_PATH = os.path.join(basedir, 'uploads')
 	ALBUMY_PHOTO_SIZE = {'small': 400, 'medium': 800}
 	ALBUMY_PHOTO_SUFFIX = {ALBUMY_PHOTO_SIZE['small']: '_s', ALBUMY_PHOTO_SIZE['medium']: '_m',}
+	ALBUMY_PHOTO_WORKERS = 2
+	ALBUMY_PHOTO_FORMATS = (('avif', 60), ('webp', 80))
+	ALBUMY_UPLOAD_MAX_AGE = 365 * 24 * 60 * 60
+	ALBUMY_SEND_FILE_MODE = os.getenv('ALBUMY_SEND_FILE_MODE')
+	ALBUMY_UPLOAD_ACCEL_PREFIX = '/_uploads/'
+	ALBUMY_AVATAR_ACCEL_PREFIX = '/_avatars/'
+	ALBUMY_THUMBNAIL_PATH = os.path.join(ALBUMY_UPLOAD_PATH, 'thumbnails')
+	ALBUMY_THUMBNAIL_WIDTHS = (200, 300, 400, 600, 800, 1200)
+	ALBUMY_THUMBNAIL_CACHE_SIZE = 1024 * 1024 * 1024
+	ALBUMY_THUMBNAIL_TOUCH_INTERVAL = 60 * 60
+	ALBUMY_THUMBNAIL_ACCEL_PREFIX = '/_thumbnails/'
+	ALBUMY_PERMISSION_CACHE_TTL = 5 * 60
+	ALBUMY_USER_CACHE_TTL = 60
+	ALBUMY_USER_CACHE_SIZE = 10000
+	ALBUMY_QUERY_BUDGET = None
+	ALBUMY_PROFILING = os.getenv('ALBUMY_PROFILING', '').lower() in ('1', 'true', 'yes', 'on')
+	ALBUMY_PROFILING_WINDOW = 1000
+	ALBUMY_SLOW_QUERY_THRESHOLD = 100
+	ALBUMY_SLOW_QUERY_LOG = os.getenv('ALBUMY_SLOW_QUERY_LOG')
+	ALBUMY_NOTIFICATION_RETENTION_DAYS = 90
+	ALBUMY_NOTIFICATION_DELAY = 1
+	ALBUMY_NOTIFICATION_BATCH_SIZE = 500
+	ALBUMY_MAIL_QUEUE_PATH = os.path.join(basedir, 'mail-queue.db')
+	ALBUMY_MAIL_WORKERS = 2
+	ALBUMY_MAIL_BATCH_SIZE = 20
+	ALBUMY_MAIL_MAX_ATTEMPTS = 6
+	ALBUMY_MAIL_RETRY_DELAY = 30
+	ALBUMY_MAIL_LEASE = 5 * 60
+	ALBUMY_MAIL_POLL_INTERVAL = 10
+	ALBUMY_TOP_TAGS = 10
+	ALBUMY_TOP_TAGS_TTL = 10 * 60
+	ALBUMY_TAG_RANKING = 'popular'
+	ALBUMY_TAG_TRENDING_HALF_LIFE = 3 * 24 * 60 * 60
+	ALBUMY_TAG_INDEX_TTL = 10 * 60
+	ALBUMY_TAG_SUGGEST_LIMIT = 10
+	ALBUMY_TAG_BATCH_SIZE = 500
+	ALBUMY_EXPLORE_PER_PAGE = 12
+	ALBUMY_EXPLORE_POOL_SIZE = 5000
+	ALBUMY_EXPLORE_POOL_TTL = 5 * 60
+	ALBUMY_EXPLORE_WINDOWS = 50
+	ALBUMY_EXPLORE_WEIGHT = None
+	ALBUMY_EXPLORE_HALF_LIFE = 30 * 24 * 60 * 60
+	ALBUMY_SEARCH_BACKEND = os.getenv('ALBUMY_SEARCH_BACKEND', 'whoosh')
+	ALBUMY_SEARCH_DELAY = 1
+	ALBUMY_SEARCH_BATCH_SIZE = 500
+	ALBUMY_SEARCH_MERGE_INTERVAL = 60 * 60
+	ALBUMY_SEARCH_SUBSTRING_MIN = 3
+	ALBUMY_SEARCH_COUNT_TTL = 60
+	ALBUMY_CACHE_BACKEND = os.getenv('ALBUMY_CACHE_BACKEND', 'simple')
+	ALBUMY_CACHE_TIMEOUT = 5 * 60
+	ALBUMY_CACHE_THRESHOLD = 1000
+	ALBUMY_CACHE_REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
 	SECRET_KEY = os.getenv('SECRET_KRY', 'I am a sexy boy')
 	MAX_CONTENT_LENGTH = 3*1024*1024
 	BOOTSTRAP_SERVE_LOCAL = True
@@ -45,18 +110,35 @@ class BaseConfig:
 	DROPZONE_MAX_FILE_SIZE = 3
 	DROPZONE_MAX_FILES = 30
 	DROPZONE_ENABLE_CSRF = True
+	ALBUMY_SQLITE_JOURNAL_MODE = 'WAL'
+	ALBUMY_SQLITE_SYNCHRONOUS = 'NORMAL'
+	ALBUMY_SQLITE_BUSY_TIMEOUT = 5000
+	ALBUMY_REPLICA_DATABASE_URI = None
 	WHOOSHEE_MIN_STRING_LEN = 1
+	WHOOSHEE_ENABLE_INDEXING = False
+	WHOOSHEE_WRITER_TIMEOUT = 2
 
 class DevelopmentConfig(BaseConfig):
 	SQLALCHEMY_DATABASE_URI = prefix + os.path.join(basedir, 'data-dev.db')
 	REDIS_URL = "redis://localhost"
+	ALBUMY_QUERY_BUDGET = 20
 
 class TestingConfig(BaseConfig):
 	TESTING = True
 	WTF_CSRF_ENABLED = False
+	ALBUMY_PHOTO_WORKERS = 0
+	ALBUMY_NOTIFICATION_DELAY = 0
+	ALBUMY_MAIL_WORKERS = 0
+	ALBUMY_CACHE_BACKEND = 'null'
+	ALBUMY_SEARCH_DELAY = 0
+	ALBUMY_USER_CACHE_TTL = 0
+	ALBUMY_QUERY_BUDGET = 20
+	WHOOSHEE_MEMORY_STORAGE = True
 	SQLALCHEMY_DATABASE_URI = 'sqlite:///'
 
 class ProductionConfig(BaseConfig):
-	SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL', prefix + os.path.join(basedir, 'data.db'))
+	SQLALCHEMY_DATABASE_URI = database_uri(os.getenv('DATABASE_URL', prefix + os.path.join(basedir, 'data.db')))
+	SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
+	ALBUMY_REPLICA_DATABASE_URI = database_uri(os.getenv('REPLICA_DATABASE_URL'))
 
 config = {'development': DevelopmentConfig, 'testing': TestingConfig, 'production': ProductionConfig, }
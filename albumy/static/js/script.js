@@ -207,6 +207,26 @@ $(function () {
         $('#tag-form').hide();
         $('#tags').show();
     });
+    // suggest existing tags for the word being typed
+    $('#tag').on('input', function () {
+        var $el = $(this);
+        var words = $el.val().split(/\s+/);
+        var prefix = words.pop();
+        if (!prefix) {
+            return;
+        }
+        $.ajax({
+            type: 'GET',
+            url: $el.data('href'),
+            data: {q: prefix},
+            success: function (data) {
+                var $list = $('#tag-suggestions').empty();
+                $.each(data.tags, function (i, tag) {
+                    $list.append($('<option>').val(words.concat(tag.name).join(' ')).text(tag.name + ' (' + tag.count + ')'));
+                });
+            }
+        });
+    });
     // hide or show description edit form
     $('#description-btn').click(function () {
         $('#description').hide();
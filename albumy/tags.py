@@ -0,0 +1,216 @@
+import bisect
+import heapq
+import math
+import time
+from collections import namedtuple, OrderedDict
+from datetime import datetime
+from threading import Lock
+
+from flask import current_app
+
+from albumy.extensions import db
+from albumy.models import Photo, Tag, tagging
+
+RankedTag = namedtuple('RankedTag', ['id', 'name', 'photos_count'])
+
+TRENDING_EPOCH = datetime(2019, 1, 1)
+
+top_tags = None
+trending_tags = None
+tag_index = None
+ranking_lock = Lock()
+
+def trending_weight(timestamp=None):
+	elapsed = ((timestamp or datetime.utcnow()) - TRENDING_EPOCH).total_seconds()
+	return elapsed / current_app.config['ALBUMY_TAG_TRENDING_HALF_LIFE'] * math.log(2)
+
+def count_tagging(tag, delta):
+	tag.photos_count = db.func.coalesce(Tag.photos_count, 0) + delta
+	if delta > 0:
+		weight = trending_weight()
+		score = tag.trending_score
+		if delta > 1:
+			weight += math.log(delta)
+		if score is None:
+			tag.trending_score = weight
+		else:
+			tag.trending_score = max(score, weight) + math.log1p(math.exp(-abs(score - weight)))
+
+def load_top_tags():
+	size = current_app.config['ALBUMY_TOP_TAGS'] * 2
+	tags = [RankedTag(*row) for row in db.session.query(Tag.id, Tag.name, Tag.photos_count).filter(Tag.photos_count > 0).order_by(Tag.photos_count.desc(), Tag.id).limit(size)]
+	floor = tags[-1].photos_count if len(tags) == size else 1
+	return dict(expires=time.time() + current_app.config['ALBUMY_TOP_TAGS_TTL'], tags=tags, floor=floor)
+
+def get_top_tags():
+	global top_tags
+	with ranking_lock:
+		if top_tags is None or top_tags['expires'] < time.time():
+			top_tags = load_top_tags()
+		return top_tags['tags'][:current_app.config['ALBUMY_TOP_TAGS']]
+
+def update_top_tags(tags):
+	global top_tags
+	with ranking_lock:
+		if top_tags is None:
+			return
+		ranked = dict((tag.id, tag) for tag in top_tags['tags'])
+		for tag in tags:
+			if tag.photos_count >= top_tags['floor']:
+				ranked[tag.id] = RankedTag(tag.id, tag.name, tag.photos_count)
+			else:
+				ranked.pop(tag.id, None)
+		size = current_app.config['ALBUMY_TOP_TAGS']
+		ranked = sorted(ranked.values(), key=lambda tag: (-tag.photos_count, tag.id))
+		if len(ranked) > size * 2:
+			ranked = ranked[:size * 2]
+			top_tags['floor'] = ranked[-1].photos_count
+		if len(ranked) < size and top_tags['floor'] > 1:
+			top_tags = None
+		else:
+			top_tags['tags'] = ranked
+
+def get_trending_tags():
+	global trending_tags
+	with ranking_lock:
+		if trending_tags is None or trending_tags[0] < time.time():
+			tags = db.session.query(Tag.id, Tag.name, Tag.photos_count).filter(Tag.photos_count > 0).order_by(Tag.trending_score.desc()).limit(current_app.config['ALBUMY_TOP_TAGS'])
+			trending_tags = (time.time() + current_app.config['ALBUMY_TOP_TAGS_TTL'], [RankedTag(*row) for row in tags])
+		return trending_tags[1]
+
+def get_hot_tags():
+	if current_app.config['ALBUMY_TAG_RANKING'] == 'trending':
+		return get_trending_tags()
+	return get_top_tags()
+
+def tag_rank(tag):
+	return -tag.photos_count, tag.name
+
+class TagIndex(object):
+	def __init__(self, tags, expires, size):
+		self.tags = dict((tag.name, tag) for tag in tags)
+		self.names = sorted(self.tags)
+		self.expires = expires
+		self.size = size
+		self.ranked = {}
+
+	def span(self, prefix):
+		return bisect.bisect_left(self.names, prefix), bisect.bisect_left(self.names, prefix + u'\U0010ffff')
+
+	def suggest(self, prefix, limit):
+		if len(prefix) <= 2 and limit <= self.size:
+			if prefix not in self.ranked:
+				self.ranked[prefix] = self.rank(prefix, self.size)
+			return self.ranked[prefix][:limit]
+		return self.rank(prefix, limit)
+
+	def rank(self, prefix, limit):
+		start, end = self.span(prefix)
+		return heapq.nsmallest(limit, (self.tags[name] for name in self.names[start:end]), key=tag_rank)
+
+	def rerank(self, prefix, tag):
+		ranked = self.ranked.get(prefix)
+		if ranked is None:
+			return
+		floor = tag_rank(ranked[-1]) if len(ranked) >= self.size else None
+		others = [other for other in ranked if other.name != tag.name]
+		if tag.photos_count > 0 and (floor is None or tag_rank(tag) <= floor):
+			self.ranked[prefix] = sorted(others + [tag], key=tag_rank)[:self.size]
+		elif len(others) < len(ranked) and floor is not None:
+			del self.ranked[prefix]
+		else:
+			self.ranked[prefix] = others
+
+	def update(self, tag):
+		tag = RankedTag(tag.id, tag.name, tag.photos_count)
+		if tag.photos_count > 0:
+			if tag.name not in self.tags:
+				bisect.insort(self.names, tag.name)
+			self.tags[tag.name] = tag
+		elif tag.name in self.tags:
+			del self.tags[tag.name]
+			del self.names[bisect.bisect_left(self.names, tag.name)]
+		for length in (0, 1, 2):
+			self.rerank(tag.name[:length], tag)
+
+def load_tag_index():
+	tags = [RankedTag(*row) for row in db.session.query(Tag.id, Tag.name, Tag.photos_count).filter(Tag.photos_count > 0)]
+	return TagIndex(tags, time.time() + current_app.config['ALBUMY_TAG_INDEX_TTL'], current_app.config['ALBUMY_TAG_SUGGEST_LIMIT'])
+
+def suggest_tags(prefix, limit=None):
+	global tag_index
+	limit = limit or current_app.config['ALBUMY_TAG_SUGGEST_LIMIT']
+	with ranking_lock:
+		if tag_index is None or tag_index.expires < time.time():
+			tag_index = load_tag_index()
+		return tag_index.suggest(prefix, limit)
+
+def update_tags(tags):
+	update_top_tags(tags)
+	with ranking_lock:
+		if tag_index is not None:
+			for tag in tags:
+				tag_index.update(tag)
+
+def resolve_tags(names):
+	tags = dict((tag.name, tag) for tag in Tag.query.filter(Tag.name.in_(names))) if names else {}
+	for name in names:
+		if name not in tags:
+			tags[name] = Tag(name=name, photos_count=0)
+	return [tags[name] for name in names]
+
+def count_tags(deltas):
+	for tag, delta in deltas.items():
+		if delta:
+			count_tagging(tag, delta)
+	db.session.flush()
+	if deltas:
+		Tag.query.filter(Tag.id.in_([tag.id for tag in deltas])).all()
+	ranked = []
+	for tag in deltas:
+		if tag.photos_count <= 0:
+			db.session.delete(tag)
+		ranked.append(RankedTag(tag.id, tag.name, tag.photos_count))
+	return ranked
+
+def untag_photos(photos):
+	photo_ids = photos.with_entities(Photo.id).subquery()
+	counts = dict(db.session.query(tagging.c.tag_id, db.func.count(tagging.c.photo_id)).filter(
+		tagging.c.photo_id.in_(db.select([photo_ids.c.id]))).group_by(tagging.c.tag_id))
+	tags = Tag.query.filter(Tag.id.in_(list(counts))).all() if counts else []
+	return dict((tag, -counts[tag.id]) for tag in tags)
+
+def tag_photos(photos, add=(), remove=()):
+	remove = list(OrderedDict.fromkeys(remove))
+	add = [name for name in OrderedDict.fromkeys(add) if name not in remove]
+	photo_ids = photos.with_entities(Photo.id).subquery()
+	added = resolve_tags(add)
+	db.session.add_all(added)
+	db.session.flush()
+	removed = Tag.query.filter(Tag.name.in_(remove)).all() if remove else []
+	deltas = OrderedDict((tag, 0) for tag in added + removed)
+	if added:
+		pairs = db.select([photo_ids.c.id.label('photo_id'), Tag.id.label('tag_id')]).where(Tag.id.in_([tag.id for tag in added])).where(
+			~db.exists().where(db.and_(tagging.c.photo_id == photo_ids.c.id, tagging.c.tag_id == Tag.id)))
+		pending = pairs.alias('pairs')
+		counts = dict(db.session.execute(db.select([pending.c.tag_id, db.func.count()]).group_by(pending.c.tag_id)).fetchall())
+		db.session.execute(tagging.insert().from_select(['photo_id', 'tag_id'], pairs))
+		for tag in added:
+			deltas[tag] = counts.get(tag.id, 0)
+	if removed:
+		detaching = db.and_(tagging.c.tag_id.in_([tag.id for tag in removed]), tagging.c.photo_id.in_(db.select([photo_ids.c.id])))
+		counts = dict(db.session.query(tagging.c.tag_id, db.func.count(tagging.c.photo_id)).filter(detaching).group_by(tagging.c.tag_id))
+		db.session.execute(tagging.delete().where(detaching))
+		for tag in removed:
+			deltas[tag] = -counts.get(tag.id, 0)
+	ranked = count_tags(deltas)
+	db.session.commit()
+	update_tags(ranked)
+	return sum(delta for delta in deltas.values() if delta > 0), -sum(delta for delta in deltas.values() if delta < 0)
+
+def clear_tag_rankings():
+	global top_tags, trending_tags, tag_index
+	with ranking_lock:
+		top_tags = None
+		trending_tags = None
+		tag_index = None
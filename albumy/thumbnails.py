@@ -0,0 +1,131 @@
+import os
+import shutil
+import tempfile
+import time
+from threading import Lock
+from zlib import crc32
+
+from flask import current_app, safe_join, abort
+
+from albumy.utils import open_image, shrink_image
+
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+
+LOCK_STRIPES = 64
+LOCKS_DIRNAME = '.locks'
+
+locks = [Lock() for i in range(LOCK_STRIPES)]
+cache_size = None
+cache_size_lock = Lock()
+
+def thumbnail_directory(width):
+	return os.path.join(current_app.config['ALBUMY_THUMBNAIL_PATH'], str(width))
+
+def thumbnail_filename(filename, ext=None):
+	if ext is None:
+		return filename
+	return os.path.splitext(filename)[0] + '.' + ext
+
+def lock_thumbnail(stripe):
+	lock_path = os.path.join(current_app.config['ALBUMY_THUMBNAIL_PATH'], LOCKS_DIRNAME, '%d.lock' % stripe)
+	if fcntl is None:
+		return None
+	if not os.path.exists(os.path.dirname(lock_path)):
+		os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+	lock_file = open(lock_path, 'w')
+	fcntl.flock(lock_file, fcntl.LOCK_EX)
+	return lock_file
+
+def unlock_thumbnail(lock_file):
+	if lock_file is not None:
+		fcntl.flock(lock_file, fcntl.LOCK_UN)
+		lock_file.close()
+
+def generate_thumbnail(source, path, width, quality=85):
+	directory = os.path.dirname(path)
+	if not os.path.exists(directory):
+		os.makedirs(directory, exist_ok=True)
+	fd, temp_path = tempfile.mkstemp(dir=directory, suffix=os.path.splitext(path)[1])
+	os.close(fd)
+	try:
+		img, source_width = open_image(source, width)
+		converted = os.path.splitext(source)[1] != os.path.splitext(path)[1]
+		if source_width <= width and not converted:
+			shutil.copyfile(source, temp_path)
+		else:
+			if source_width > width:
+				img = shrink_image(img, width)
+			if converted and img.mode not in ('RGB', 'RGBA'):
+				img = img.convert('RGBA')
+			img.save(temp_path, optimize=True, quality=quality)
+		os.replace(temp_path, path)
+	except Exception:
+		os.remove(temp_path)
+		raise
+	return os.path.getsize(path)
+
+def evict_thumbnails(limit, keep=None):
+	entries = []
+	for root, dirs, files in os.walk(current_app.config['ALBUMY_THUMBNAIL_PATH']):
+		if LOCKS_DIRNAME in dirs:
+			dirs.remove(LOCKS_DIRNAME)
+		for name in files:
+			path = os.path.join(root, name)
+			try:
+				stat = os.stat(path)
+			except OSError:
+				continue
+			entries.append((stat.st_mtime, stat.st_size, path))
+	total = sum(size for mtime, size, path in entries)
+	if total <= limit:
+		return total
+	entries.sort()
+	for mtime, size, path in entries:
+		if total <= limit * 0.9:
+			break
+		if path == keep:
+			continue
+		try:
+			os.remove(path)
+		except OSError:
+			continue
+		total -= size
+	return total
+
+def account_thumbnail(path, size):
+	global cache_size
+	limit = current_app.config['ALBUMY_THUMBNAIL_CACHE_SIZE']
+	with cache_size_lock:
+		if cache_size is None:
+			cache_size = evict_thumbnails(limit, keep=path)
+		else:
+			cache_size += size
+		if cache_size > limit:
+			cache_size = evict_thumbnails(limit, keep=path)
+
+def make_thumbnail(filename, width, ext=None):
+	source = safe_join(current_app.config['ALBUMY_UPLOAD_PATH'], filename)
+	path = safe_join(thumbnail_directory(width), thumbnail_filename(filename, ext))
+	try:
+		stat = os.stat(path)
+	except OSError:
+		pass
+	else:
+		if time.time() - stat.st_mtime > current_app.config['ALBUMY_THUMBNAIL_TOUCH_INTERVAL']:
+			os.utime(path)
+		return path
+
+	if not os.path.isfile(source):
+		abort(404)
+	stripe = crc32(path.encode('utf-8')) % LOCK_STRIPES
+	with locks[stripe]:
+		lock_file = lock_thumbnail(stripe)
+		try:
+			if not os.path.exists(path):
+				account_thumbnail(path, generate_thumbnail(source, path, width))
+		finally:
+			unlock_thumbnail(lock_file)
+	return path
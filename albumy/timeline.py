@@ -0,0 +1,47 @@
+from flask import current_app
+
+from albumy.extensions import db
+from albumy.models import User, Photo, Follow, Timeline
+from albumy.pagination import KeysetPagination, decode_cursor, keyset_filter, keyset_order
+
+def is_pull_author(user):
+	return user.followers_count > current_app.config['ALBUMY_TIMELINE_FANOUT_LIMIT']
+
+def push_photo(photo):
+	author = photo.author
+	if is_pull_author(author):
+		return
+	followers = db.select([Follow.follower_id, db.literal(photo.id), db.literal(author.id), db.literal(photo.timestamp, db.DateTime)]).where(Follow.followed_id == author.id)
+	db.session.execute(Timeline.__table__.insert().from_select(['user_id', 'photo_id', 'author_id', 'timestamp'], followers))
+
+def backfill_timeline(user, followed):
+	if user.id is None or followed.id is None or is_pull_author(followed):
+		return
+	photos = db.select([db.literal(user.id), Photo.id, Photo.author_id, Photo.timestamp]).where(Photo.author_id == followed.id).order_by(Photo.timestamp.desc()).limit(current_app.config['ALBUMY_TIMELINE_BACKFILL'])
+	db.session.execute(Timeline.__table__.insert().from_select(['user_id', 'photo_id', 'author_id', 'timestamp'], photos))
+
+def prune_timeline(user, followed):
+	Timeline.query.filter_by(user_id=user.id, author_id=followed.id).delete(synchronize_session=False)
+
+def rebuild_timeline():
+	Timeline.query.delete(synchronize_session=False)
+	limit = current_app.config['ALBUMY_TIMELINE_FANOUT_LIMIT']
+	entries = db.select([Follow.follower_id, Photo.id, Photo.author_id, Photo.timestamp]).select_from(Follow.__table__.join(Photo.__table__, Follow.followed_id == Photo.author_id).join(User.__table__, User.id == Follow.followed_id)).where(User.followers_count <= limit)
+	db.session.execute(Timeline.__table__.insert().from_select(['user_id', 'photo_id', 'author_id', 'timestamp'], entries))
+	db.session.commit()
+
+def get_timeline(user, cursor, per_page):
+	direction, key = decode_cursor(cursor)
+	pushed = db.session.query(Timeline.timestamp, Timeline.photo_id).filter(Timeline.user_id == user.id)
+	pulled = db.session.query(Photo.timestamp, Photo.id).join(Follow, Follow.followed_id == Photo.author_id).join(User, User.id == Follow.followed_id).filter(Follow.follower_id == user.id, User.followers_count > current_app.config['ALBUMY_TIMELINE_FANOUT_LIMIT'])
+	if key is not None:
+		pushed = pushed.filter(keyset_filter(Timeline.timestamp, Timeline.photo_id, key, direction))
+		pulled = pulled.filter(keyset_filter(Photo.timestamp, Photo.id, key, direction))
+	pushed = pushed.order_by(*keyset_order(Timeline.timestamp, Timeline.photo_id, direction)).limit(per_page + 1)
+	pulled = pulled.order_by(*keyset_order(Photo.timestamp, Photo.id, direction)).limit(per_page + 1)
+
+	entries = sorted(set(pushed.all() + pulled.all()), reverse=direction != 'p')[:per_page + 1]
+	photo_ids = [photo_id for timestamp, photo_id in entries]
+	photos = dict((photo.id, photo) for photo in Photo.query.options(db.joinedload(Photo.author)).filter(Photo.id.in_(photo_ids))) if photo_ids else {}
+	rows = [photos[photo_id] for photo_id in photo_ids if photo_id in photos]
+	return KeysetPagination.from_rows(rows, lambda photo: (photo.timestamp, photo.id), direction, key is not None, per_page)
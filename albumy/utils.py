@@ -5,17 +5,19 @@
     :copyright: © 2018 Grey Li <withlihui@gmail.com>
     :license: MIT, see LICENSE for more details.
 """
+import mimetypes
 import os
+import re
 import uuid
+from zlib import adler32
 
 try:
     from urlparse import urlparse, urljoin
 except ImportError:
     from urllib.parse import urlparse, urljoin
 
-import PIL
-from PIL import Image
-from flask import current_app, request, url_for, redirect, flash
+from PIL import Image, ImageOps
+from flask import current_app, request, url_for, redirect, flash, abort, safe_join, send_file
 from itsdangerous import BadSignature, SignatureExpired
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 
@@ -67,18 +69,106 @@ def rename_image(old_filename):
     return new_filename
 
 
-def resize_image(image, filename, base_width):
-    filename, ext = os.path.splitext(filename)
+EXIF_ORIENTATION = 0x0112
+UNREDUCIBLE_MODES = ('1', 'P')
+
+
+def shrink_image(img, base_width):
+    h_size = int(img.size[1] * base_width / float(img.size[0]))
+    factor = img.size[0] // (base_width * 2)
+    if factor > 1 and hasattr(img, 'reduce') and img.mode not in UNREDUCIBLE_MODES:
+        img = img.reduce(factor)
+    return img.resize((base_width, h_size), Image.LANCZOS)
+
+
+def open_image(image, base_width):
     img = Image.open(image)
-    if img.size[0] <= base_width:
-        return filename + ext
-    w_percent = (base_width / float(img.size[0]))
-    h_size = int((float(img.size[1]) * float(w_percent)))
-    img = img.resize((base_width, h_size), PIL.Image.ANTIALIAS)
-
-    filename += current_app.config['ALBUMY_PHOTO_SUFFIX'][base_width] + ext
-    img.save(os.path.join(current_app.config['ALBUMY_UPLOAD_PATH'], filename), optimize=True, quality=85)
-    return filename
+    orientation = img.getexif().get(EXIF_ORIENTATION, 1)
+    width = img.size[1] if orientation > 4 else img.size[0]
+    if img.format == 'JPEG' and width > base_width:
+        scale = base_width / float(width)
+        img.draft(img.mode, (int(img.size[0] * scale), int(img.size[1] * scale)))
+    if orientation != 1:
+        img = ImageOps.exif_transpose(img)
+    return img, width
+
+
+def resize_images(image, filename, base_widths):
+    filename, ext = os.path.splitext(filename)
+    img, width = open_image(image, max(base_widths))
+
+    filenames = {}
+    for base_width in sorted(base_widths, reverse=True):
+        if width <= base_width:
+            filenames[base_width] = filename + ext
+            continue
+        img = shrink_image(img, base_width)
+        filenames[base_width] = filename + current_app.config['ALBUMY_PHOTO_SUFFIX'][base_width] + ext
+        img.save(os.path.join(current_app.config['ALBUMY_UPLOAD_PATH'], filenames[base_width]), optimize=True, quality=85)
+        save_image_variants(img, filenames[base_width])
+    return [filenames[base_width] for base_width in base_widths]
+
+
+def supported_image_formats():
+    Image.init()
+    return [(ext, quality) for ext, quality in current_app.config['ALBUMY_PHOTO_FORMATS'] if ext.upper() in Image.SAVE]
+
+
+def negotiate_image_format(formats):
+    accepted = [value for value, quality in request.accept_mimetypes if quality]
+    for ext in formats:
+        if 'image/' + ext in accepted:
+            return ext
+    return None
+
+
+def save_image_variants(img, filename):
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA')
+    filename = os.path.splitext(filename)[0]
+    for ext, quality in supported_image_formats():
+        img.save(os.path.join(current_app.config['ALBUMY_UPLOAD_PATH'], filename + '.' + ext), quality=quality)
+
+
+UPLOAD_FILENAME = re.compile(r'^[0-9a-f]{32}(_[a-z]+)?\.\w+$')
+
+
+def send_upload(directory, filename, accel_prefix, mimetype=None):
+    path = safe_join(directory, filename)
+    if not os.path.isfile(path):
+        abort(404)
+    stat = os.stat(path)
+    immutable = UPLOAD_FILENAME.match(filename) is not None
+    mode = current_app.config['ALBUMY_SEND_FILE_MODE']
+
+    if mode is None:
+        response = send_file(path, mimetype=mimetype, add_etags=False, conditional=False)
+    else:
+        response = current_app.response_class(mimetype=mimetype or mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.last_modified = stat.st_mtime
+        response.headers.pop('Content-Length', None)
+        if mode == 'x-accel-redirect':
+            response.headers['X-Accel-Redirect'] = accel_prefix + filename
+        else:
+            response.headers['X-Sendfile'] = path
+
+    if immutable:
+        response.set_etag('%08x-%x' % (adler32(filename.encode('utf-8')), stat.st_size))
+        response.headers['Cache-Control'] = 'public, max-age=%d, immutable' % current_app.config['ALBUMY_UPLOAD_MAX_AGE']
+        response.headers.pop('Expires', None)
+    else:
+        response.set_etag('%08x-%x-%x' % (adler32(filename.encode('utf-8')), int(stat.st_mtime), stat.st_size))
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.get_send_file_max_age(filename)
+
+    if mode is None:
+        response = response.make_conditional(request, accept_ranges=True, complete_length=stat.st_size)
+    else:
+        response = response.make_conditional(request)
+        if response.status_code == 304:
+            response.headers.pop('X-Accel-Redirect', None)
+            response.headers.pop('X-Sendfile', None)
+    return response
 
 
 def is_safe_url(target):
@@ -0,0 +1,82 @@
+"""
+Compare per-upload CPU time and peak RSS of the old per-size resize with
+utils.resize_images on large JPEG inputs.
+
+    $ python benchmarks/resize.py --megapixels 12 24 --runs 3
+
+Each variant runs in a fresh child process so ru_maxrss reflects only
+that variant.
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+import click
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ASPECT = (4, 3)
+
+def make_image(path, megapixels):
+	unit = int((megapixels * 1000000 / (ASPECT[0] * ASPECT[1])) ** 0.5)
+	size = (unit * ASPECT[0], unit * ASPECT[1])
+	noise = Image.effect_noise((size[0] // 8, size[1] // 8), 64).convert('RGB')
+	noise.resize(size, Image.BICUBIC).save(path, quality=92)
+
+def old_resize_image(image, filename, base_width, config):
+	filename, ext = os.path.splitext(filename)
+	img = Image.open(image)
+	if img.size[0] <= base_width:
+		return filename + ext
+	w_percent = (base_width / float(img.size[0]))
+	h_size = int((float(img.size[1]) * float(w_percent)))
+	img = img.resize((base_width, h_size), Image.LANCZOS)
+	filename += config['ALBUMY_PHOTO_SUFFIX'][base_width] + ext
+	img.save(os.path.join(config['ALBUMY_UPLOAD_PATH'], filename), optimize=True, quality=85)
+	return filename
+
+def run_child(variant, path, runs):
+	from albumy import create_app
+	from albumy.utils import resize_images
+
+	app = create_app('testing')
+	app.config['ALBUMY_UPLOAD_PATH'] = os.path.dirname(path)
+	sizes = app.config['ALBUMY_PHOTO_SIZE']
+	widths = [sizes['small'], sizes['medium']]
+	filename = os.path.basename(path)
+
+	with app.app_context():
+		before = resource.getrusage(resource.RUSAGE_SELF)
+		for i in range(runs):
+			if variant == 'old':
+				for width in widths:
+					old_resize_image(path, filename, width, app.config)
+			else:
+				resize_images(path, filename, widths)
+		after = resource.getrusage(resource.RUSAGE_SELF)
+	cpu = (after.ru_utime + after.ru_stime - before.ru_utime - before.ru_stime) / runs
+	click.echo('%f %d' % (cpu, after.ru_maxrss))
+
+@click.command()
+@click.option('--megapixels', '-m', multiple=True, type=int, help='Input sizes in megapixels, default is 12 and 24.')
+@click.option('--runs', default=3, help='Uploads per measurement, default is 3.')
+@click.option('--child', nargs=2, hidden=True)
+def main(megapixels, runs, child):
+	if child:
+		return run_child(child[0], child[1], runs)
+
+	workdir = tempfile.mkdtemp()
+	click.echo('%-6s %-8s %14s %14s' % ('MP', 'variant', 'CPU/upload (s)', 'peak RSS (MB)'))
+	for mp in megapixels or (12, 24):
+		path = os.path.join(workdir, 'input_%d.jpg' % mp)
+		make_image(path, mp)
+		for variant in ('old', 'new'):
+			output = subprocess.check_output([sys.executable, __file__, '--runs', str(runs), '--child', variant, path])
+			cpu, rss = output.split()
+			click.echo('%-6d %-8s %14.3f %14.1f' % (mp, variant, float(cpu), int(rss) / 1024.0))
+
+if __name__ == '__main__':
+	main()
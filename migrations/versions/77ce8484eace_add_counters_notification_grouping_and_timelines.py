@@ -0,0 +1,148 @@
+"""Add counters, notification grouping and timelines
+
+Backfills the new counters and home timelines from the existing rows. Skipped
+when the timeline table already exists, i.e. the database was created with
+create_all from models that already had these columns.
+
+Revision ID: 77ce8484eace
+Revises: 123d829a45be
+Create Date: 2026-10-18 09:20:41.502916
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from flask import current_app
+
+
+# revision identifiers, used by Alembic.
+revision = '77ce8484eace'
+down_revision = '123d829a45be'
+branch_labels = None
+depends_on = None
+
+user = sa.table('user', sa.column('id'), sa.column('photos_count'), sa.column('collections_count'),
+                sa.column('followers_count'), sa.column('following_count'), sa.column('unread_notifications_count'))
+photo = sa.table('photo', sa.column('id'), sa.column('author_id'), sa.column('timestamp'), sa.column('processing'),
+                 sa.column('collectors_count'), sa.column('comments_count'))
+tag = sa.table('tag', sa.column('id'), sa.column('photos_count'))
+tagging = sa.table('tagging', sa.column('photo_id'), sa.column('tag_id'))
+collect = sa.table('collect', sa.column('collector_id'), sa.column('collected_id'))
+comment = sa.table('comment', sa.column('id'), sa.column('photo_id'))
+follow = sa.table('follow', sa.column('follower_id'), sa.column('followed_id'))
+notification = sa.table('notification', sa.column('id'), sa.column('message'), sa.column('receiver_id'), sa.column('is_read'),
+                        sa.column('count'))
+timeline = sa.table('timeline', sa.column('user_id'), sa.column('photo_id'), sa.column('author_id'), sa.column('timestamp'))
+
+
+def count(column, *criteria):
+    return sa.select([sa.func.count(column)]).where(sa.and_(*criteria)).as_scalar()
+
+
+def upgrade():
+    if 'timeline' in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table('archived_notification',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('message', sa.Text(), nullable=True),
+        sa.Column('type', sa.String(length=20), nullable=True),
+        sa.Column('target_id', sa.Integer(), nullable=True),
+        sa.Column('count', sa.Integer(), nullable=True),
+        sa.Column('timestamp', sa.DateTime(), nullable=True),
+        sa.Column('receiver_id', sa.Integer(), nullable=True),
+        sa.Column('actor_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['actor_id'], ['user.id'], ),
+        sa.ForeignKeyConstraint(['receiver_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_archived_notification_receiver_id'), 'archived_notification', ['receiver_id'], unique=False)
+    op.create_table('timeline',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('photo_id', sa.Integer(), nullable=False),
+        sa.Column('author_id', sa.Integer(), nullable=True),
+        sa.Column('timestamp', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['author_id'], ['user.id'], ),
+        sa.ForeignKeyConstraint(['photo_id'], ['photo.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+        sa.PrimaryKeyConstraint('user_id', 'photo_id')
+    )
+    op.create_index(op.f('ix_timeline_author_id'), 'timeline', ['author_id'], unique=False)
+    op.create_index('ix_timeline_user_timestamp', 'timeline', ['user_id', 'timestamp', 'photo_id'], unique=False)
+
+    with op.batch_alter_table('notification', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('type', sa.String(length=20), nullable=True))
+        batch_op.add_column(sa.Column('target_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('count', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('actor_id', sa.Integer(), sa.ForeignKey('user.id', name='fk_notification_actor_id_user'), nullable=True))
+        batch_op.alter_column('message', existing_type=sa.Text(), nullable=True)
+        batch_op.create_index('ix_notification_receiver_read_timestamp', ['receiver_id', 'is_read', 'timestamp'], unique=False)
+
+    with op.batch_alter_table('photo', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('processing', sa.Boolean(), nullable=True))
+        batch_op.add_column(sa.Column('collectors_count', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('comments_count', sa.Integer(), nullable=True))
+
+    with op.batch_alter_table('tag', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('photos_count', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('trending_score', sa.Float(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_tag_photos_count'), ['photos_count'], unique=False)
+        batch_op.create_index(batch_op.f('ix_tag_trending_score'), ['trending_score'], unique=False)
+
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('photos_count', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('collections_count', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('followers_count', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('following_count', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('unread_notifications_count', sa.Integer(), nullable=True))
+
+    op.execute(notification.update().values(count=1))
+    op.execute(photo.update().values(
+        processing=False,
+        collectors_count=count(collect.c.collector_id, collect.c.collected_id == photo.c.id),
+        comments_count=count(comment.c.id, comment.c.photo_id == photo.c.id)))
+    op.execute(tag.update().values(photos_count=count(sa.distinct(tagging.c.photo_id), tagging.c.tag_id == tag.c.id)))
+    op.execute(user.update().values(
+        photos_count=count(photo.c.id, photo.c.author_id == user.c.id),
+        collections_count=count(collect.c.collected_id, collect.c.collector_id == user.c.id),
+        followers_count=count(follow.c.follower_id, follow.c.followed_id == user.c.id, follow.c.follower_id != user.c.id),
+        following_count=count(follow.c.followed_id, follow.c.follower_id == user.c.id, follow.c.followed_id != user.c.id),
+        unread_notifications_count=count(notification.c.id, notification.c.receiver_id == user.c.id, notification.c.is_read == sa.false())))
+
+    entries = sa.select([follow.c.follower_id, photo.c.id, photo.c.author_id, photo.c.timestamp]).select_from(
+        follow.join(photo, follow.c.followed_id == photo.c.author_id).join(user, user.c.id == follow.c.followed_id)).where(
+        user.c.followers_count <= current_app.config['ALBUMY_TIMELINE_FANOUT_LIMIT'])
+    op.execute(timeline.insert().from_select(['user_id', 'photo_id', 'author_id', 'timestamp'], entries))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('unread_notifications_count')
+        batch_op.drop_column('following_count')
+        batch_op.drop_column('followers_count')
+        batch_op.drop_column('collections_count')
+        batch_op.drop_column('photos_count')
+
+    with op.batch_alter_table('tag', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_tag_trending_score'))
+        batch_op.drop_index(batch_op.f('ix_tag_photos_count'))
+        batch_op.drop_column('trending_score')
+        batch_op.drop_column('photos_count')
+
+    with op.batch_alter_table('photo', schema=None) as batch_op:
+        batch_op.drop_column('comments_count')
+        batch_op.drop_column('collectors_count')
+        batch_op.drop_column('processing')
+
+    op.execute(notification.delete().where(notification.c.message == None))
+    with op.batch_alter_table('notification', schema=None) as batch_op:
+        batch_op.drop_index('ix_notification_receiver_read_timestamp')
+        batch_op.alter_column('message', existing_type=sa.Text(), nullable=False)
+        batch_op.drop_column('actor_id')
+        batch_op.drop_column('count')
+        batch_op.drop_column('target_id')
+        batch_op.drop_column('type')
+
+    op.drop_index('ix_timeline_user_timestamp', table_name='timeline')
+    op.drop_index(op.f('ix_timeline_author_id'), table_name='timeline')
+    op.drop_table('timeline')
+    op.drop_index(op.f('ix_archived_notification_receiver_id'), table_name='archived_notification')
+    op.drop_table('archived_notification')
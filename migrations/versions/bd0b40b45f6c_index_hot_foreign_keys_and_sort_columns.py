@@ -0,0 +1,70 @@
+"""Index hot foreign keys and sort columns
+
+Revision ID: bd0b40b45f6c
+Revises: 77ce8484eace
+Create Date: 2026-10-18 07:36:30.533382
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'bd0b40b45f6c'
+down_revision = '77ce8484eace'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('tagging_deduplicated',
+        sa.Column('photo_id', sa.Integer(), nullable=False),
+        sa.Column('tag_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['photo_id'], ['photo.id'], ),
+        sa.ForeignKeyConstraint(['tag_id'], ['tag.id'], ),
+        sa.PrimaryKeyConstraint('photo_id', 'tag_id')
+    )
+    op.execute('INSERT INTO tagging_deduplicated (photo_id, tag_id) '
+               'SELECT DISTINCT photo_id, tag_id FROM tagging WHERE photo_id IS NOT NULL AND tag_id IS NOT NULL')
+    op.drop_table('tagging')
+    op.rename_table('tagging_deduplicated', 'tagging')
+    op.create_index('ix_tagging_tag_photo', 'tagging', ['tag_id', 'photo_id'], unique=False)
+
+    op.create_index('ix_collect_collected_timestamp', 'collect', ['collected_id', 'timestamp', 'collector_id'], unique=False)
+    op.create_index('ix_collect_collector_timestamp', 'collect', ['collector_id', 'timestamp', 'collected_id'], unique=False)
+    op.create_index('ix_comment_author_id', 'comment', ['author_id'], unique=False)
+    op.create_index('ix_comment_flag', 'comment', ['flag', 'id'], unique=False)
+    op.create_index('ix_comment_photo_timestamp', 'comment', ['photo_id', 'timestamp', 'id'], unique=False)
+    op.create_index('ix_comment_replied_id', 'comment', ['replied_id'], unique=False)
+    op.create_index('ix_follow_followed_timestamp', 'follow', ['followed_id', 'timestamp', 'follower_id'], unique=False)
+    op.create_index('ix_follow_follower_timestamp', 'follow', ['follower_id', 'timestamp', 'followed_id'], unique=False)
+    op.create_index('ix_notification_actor_id', 'notification', ['actor_id'], unique=False)
+    op.create_index('ix_notification_receiver_timestamp', 'notification', ['receiver_id', 'timestamp', 'id'], unique=False)
+    op.create_index('ix_photo_author_timestamp', 'photo', ['author_id', 'timestamp', 'id'], unique=False)
+    op.create_index('ix_photo_flag', 'photo', ['flag', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_photo_flag', table_name='photo')
+    op.drop_index('ix_photo_author_timestamp', table_name='photo')
+    op.drop_index('ix_notification_receiver_timestamp', table_name='notification')
+    op.drop_index('ix_notification_actor_id', table_name='notification')
+    op.drop_index('ix_follow_follower_timestamp', table_name='follow')
+    op.drop_index('ix_follow_followed_timestamp', table_name='follow')
+    op.drop_index('ix_comment_replied_id', table_name='comment')
+    op.drop_index('ix_comment_photo_timestamp', table_name='comment')
+    op.drop_index('ix_comment_flag', table_name='comment')
+    op.drop_index('ix_comment_author_id', table_name='comment')
+    op.drop_index('ix_collect_collector_timestamp', table_name='collect')
+    op.drop_index('ix_collect_collected_timestamp', table_name='collect')
+
+    op.drop_index('ix_tagging_tag_photo', table_name='tagging')
+    op.create_table('tagging_duplicated',
+        sa.Column('photo_id', sa.Integer(), nullable=True),
+        sa.Column('tag_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['photo_id'], ['photo.id'], ),
+        sa.ForeignKeyConstraint(['tag_id'], ['tag.id'], )
+    )
+    op.execute('INSERT INTO tagging_duplicated (photo_id, tag_id) SELECT photo_id, tag_id FROM tagging')
+    op.drop_table('tagging')
+    op.rename_table('tagging_duplicated', 'tagging')
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import url_for
+
+from albumy import create_app
+from albumy.extensions import db
+from albumy.models import User, Role
+
+
+class BaseTestCase(unittest.TestCase):
+
+    def setUp(self):
+        app = create_app('testing')
+        self.upload_path = tempfile.mkdtemp()
+        app.config['ALBUMY_UPLOAD_PATH'] = self.upload_path
+        app.config['ALBUMY_THUMBNAIL_PATH'] = os.path.join(self.upload_path, 'thumbnails')
+        app.config['ALBUMY_MAIL_QUEUE_PATH'] = os.path.join(self.upload_path, 'mail-queue.db')
+        app.config['AVATARS_SAVE_PATH'] = os.path.join(self.upload_path, 'avatars')
+        os.makedirs(app.config['AVATARS_SAVE_PATH'])
+        self.app = app
+        self.context = app.test_request_context()
+        self.context.push()
+        self.client = app.test_client()
+        self.runner = app.test_cli_runner()
+
+        db.create_all()
+        Role.init_role()
+
+        admin_user = User(email='admin@helloflask.com', name='Admin', username='admin', confirmed=True)
+        admin_user.set_password('123')
+        normal_user = User(email='normal@helloflask.com', name='Normal User', username='normal', confirmed=True)
+        normal_user.set_password('123')
+        db.session.add_all([admin_user, normal_user])
+        db.session.commit()
+        admin_user.role = Role.query.filter_by(name='Administrator').first()
+        normal_user.role = Role.query.filter_by(name='User').first()
+        db.session.commit()
+
+    def tearDown(self):
+        db.drop_all()
+        self.context.pop()
+        shutil.rmtree(self.upload_path)
+
+    def login(self, email=None, password=None):
+        if email is None and password is None:
+            email = 'normal@helloflask.com'
+            password = '123'
+
+        return self.client.post(url_for('auth.login'), data=dict(
+            email=email,
+            password=password
+        ), follow_redirects=True)
+
+    def logout(self):
+        return self.client.get(url_for('auth.logout'), follow_redirects=True)
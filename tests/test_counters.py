@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from flask import url_for
+
+from albumy.extensions import db
+from albumy.models import User, Photo, Tag, Comment
+from albumy.tags import tag_photos
+from tests.base import BaseTestCase
+
+
+class CounterTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(CounterTestCase, self).setUp()
+        admin = User.query.filter_by(username='admin').first()
+        normal = User.query.filter_by(username='normal').first()
+        own = Photo(filename='own.jpg', filename_s='own_s.jpg', filename_m='own_m.jpg', author=normal)
+        other = Photo(filename='other.jpg', filename_s='other_s.jpg', filename_m='other_m.jpg', author=admin)
+        db.session.add_all([own, other])
+        db.session.commit()
+        self.own_id, self.other_id = own.id, other.id
+        tag_photos(Photo.query.filter_by(id=own.id), add=['solo', 'shared'])
+        tag_photos(Photo.query.filter_by(id=other.id), add=['shared'])
+
+    def test_tag_counts(self):
+        self.assertEqual(Tag.query.filter_by(name='shared').first().photos_count, 2)
+        self.assertEqual(Tag.query.filter_by(name='solo').first().photos_count, 1)
+
+    def test_delete_photo_drops_orphan_tags(self):
+        self.login()
+        self.client.post(url_for('main.delete_photo', photo_id=self.own_id))
+        db.session.remove()
+        self.assertIsNone(Tag.query.filter_by(name='solo').first())
+        self.assertEqual(Tag.query.filter_by(name='shared').first().photos_count, 1)
+
+    def test_delete_account_recounts_replies(self):
+        normal = User.query.filter_by(username='normal').first()
+        admin = User.query.filter_by(username='admin').first()
+        other = Photo.query.get(self.other_id)
+        comment = Comment(body='comment', author=normal, photo=other)
+        reply = Comment(body='reply', author=admin, photo=other, replied=comment)
+        db.session.add_all([comment, reply])
+        other.comments_count = 2
+        db.session.commit()
+
+        self.login()
+        self.client.post(url_for('user.delete_account'), data=dict(username='normal'))
+        db.session.remove()
+        self.assertEqual(Photo.query.get(self.other_id).comments_count, 0)
+        self.assertIsNone(Tag.query.filter_by(name='solo').first())
+        self.assertEqual(Tag.query.filter_by(name='shared').first().photos_count, 1)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+from unittest import mock
+
+from flask import g, url_for
+
+from albumy.extensions import db
+from albumy.models import User
+from albumy.settings import TestingConfig
+from tests.base import BaseTestCase
+
+
+class ReplicaTestCase(BaseTestCase):
+
+    def setUp(self):
+        fd, self.replica_path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        with mock.patch.object(TestingConfig, 'ALBUMY_REPLICA_DATABASE_URI', 'sqlite:///' + self.replica_path):
+            super(ReplicaTestCase, self).setUp()
+        self.replica = self.app.extensions['replica_engine']
+        db.metadata.create_all(bind=self.replica)
+        self.replica.execute(User.__table__.insert(), username='replica', email='replica@helloflask.com', name='Replica',
+                             avatar_s='replica_s.png', avatar_m='replica_m.png', avatar_l='replica_l.png',
+                             confirmed=True, active=True, locked=False, public_collections=True)
+
+    def tearDown(self):
+        super(ReplicaTestCase, self).tearDown()
+        self.replica.dispose()
+        os.remove(self.replica_path)
+
+    def test_list_views_read_replica(self):
+        response = self.client.get(url_for('user.index', username='replica'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Replica', response.get_data(as_text=True))
+        response = self.client.get(url_for('user.index', username='normal'))
+        self.assertEqual(response.status_code, 404)
+
+    def test_other_views_read_primary(self):
+        self.login()
+        response = self.client.get(url_for('user.edit_profile'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Normal User', response.get_data(as_text=True))
+
+    def test_writes_stick_to_primary(self):
+        with self.app.test_request_context():
+            g.use_replica = True
+            self.assertEqual(User.query.filter_by(username='replica').count(), 1)
+            db.session.add(User(username='written', email='written@helloflask.com', name='Written'))
+            db.session.flush()
+            self.assertFalse(g.use_replica)
+            self.assertEqual(User.query.filter_by(username='written').count(), 1)
+            self.assertEqual(User.query.filter_by(username='replica').count(), 0)
+            db.session.rollback()
+
+        with self.app.test_request_context():
+            g.use_replica = True
+            User.query.filter_by(username='normal').update({User.bio: 'Bio'}, synchronize_session=False)
+            self.assertEqual(User.query.filter_by(username='normal', bio='Bio').count(), 1)
+            db.session.rollback()
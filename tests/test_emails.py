@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+import socket
+import time
+import unittest
+from contextlib import closing
+
+from albumy.emails import send_mail, deliver_mail, close_connection, connect_queue
+from tests.base import BaseTestCase
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:
+    Controller = None
+
+
+class SinkHandler(object):
+
+    def __init__(self):
+        self.messages = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith('refused@'):
+            return '550 Mailbox unavailable'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return '250 OK'
+
+
+@unittest.skipIf(Controller is None, 'aiosmtpd is not installed')
+class EmailTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(EmailTestCase, self).setUp()
+        self.handler = SinkHandler()
+        with closing(socket.socket()) as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        self.controller = Controller(self.handler, hostname='127.0.0.1', port=port)
+        self.controller.start()
+        state = self.app.extensions['mail']
+        state.server = '127.0.0.1'
+        state.port = port
+        state.use_ssl = False
+        state.use_tls = False
+        state.username = state.password = None
+        state.suppress = False
+        state.default_sender = 'admin@helloflask.com'
+
+    def tearDown(self):
+        self.controller.stop()
+        super(EmailTestCase, self).tearDown()
+
+    def query_queue(self, sql):
+        with closing(connect_queue(self.app)) as db:
+            return db.execute(sql).fetchall()
+
+    def test_send_mail(self):
+        send_mail('normal@helloflask.com', 'Email Confirm', 'emails/confirm', user=None, token='token')
+        self.assertEqual(len(self.handler.messages), 1)
+        self.assertEqual(self.handler.messages[0].rcpt_tos, ['normal@helloflask.com'])
+        self.assertIn(b'token', self.handler.messages[0].content)
+        self.assertEqual(self.query_queue('SELECT * FROM mail_queue'), [])
+
+    def test_refused_mail_is_dead_lettered(self):
+        send_mail('refused@helloflask.com', 'Email Confirm', 'emails/confirm', user=None, token='token')
+        self.assertEqual(self.handler.messages, [])
+        self.assertEqual(self.query_queue('SELECT * FROM mail_queue'), [])
+        self.assertEqual(self.query_queue('SELECT attempts FROM mail_dead_letter'), [(1,)])
+
+    def test_broken_mail_is_released(self):
+        with closing(connect_queue(self.app)) as db:
+            db.execute('INSERT INTO mail_queue (message, next_attempt) VALUES (?, ?)', ('not json', time.time()))
+        send_mail('normal@helloflask.com', 'Email Confirm', 'emails/confirm', user=None, token='token')
+        self.assertEqual(len(self.handler.messages), 1)
+        self.assertEqual(self.query_queue('SELECT attempts, locked_until FROM mail_queue'), [(1, 0)])
+
+        self.app.config['ALBUMY_MAIL_MAX_ATTEMPTS'] = 2
+        with closing(connect_queue(self.app)) as db:
+            db.execute('UPDATE mail_queue SET next_attempt = 0')
+        count, connection = deliver_mail(self.app)
+        close_connection(connection)
+        self.assertEqual(count, 1)
+        self.assertEqual(self.query_queue('SELECT * FROM mail_queue'), [])
+        self.assertEqual(self.query_queue('SELECT message, attempts FROM mail_dead_letter'), [('not json', 2)])
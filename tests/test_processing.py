@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import os
+from unittest import mock
+
+from PIL import Image
+
+from albumy import processing
+from albumy.extensions import db
+from albumy.models import User, Photo
+from albumy.utils import resize_images
+from tests.base import BaseTestCase
+
+
+class ProcessingTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(ProcessingTestCase, self).setUp()
+        Image.new('RGB', (1600, 1200)).save(os.path.join(self.upload_path, 'photo.jpg'))
+        photo = Photo(filename='photo.jpg', filename_s='photo.jpg', filename_m='photo.jpg', processing=True,
+                      author=User.query.filter_by(username='normal').first())
+        db.session.add(photo)
+        db.session.commit()
+        self.photo_id = photo.id
+
+    def test_generate_thumbnails(self):
+        processing.generate_thumbnails(self.photo_id)
+        photo = Photo.query.get(self.photo_id)
+        self.assertFalse(photo.processing)
+        self.assertEqual((photo.filename_s, photo.filename_m), ('photo_s.jpg', 'photo_m.jpg'))
+
+    def test_photo_deleted_while_processing(self):
+        def resize_and_delete(*args, **kwargs):
+            filenames = resize_images(*args, **kwargs)
+            db.session.delete(Photo.query.get(self.photo_id))
+            db.session.commit()
+            return filenames
+
+        with mock.patch.object(processing, 'resize_images', resize_and_delete):
+            processing.generate_thumbnails(self.photo_id)
+        self.assertIsNone(Photo.query.get(self.photo_id))
+        self.assertEqual(os.listdir(self.upload_path), ['avatars'])
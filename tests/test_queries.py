@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+from flask import url_for
+
+from albumy.extensions import db
+from albumy.models import User, Photo, Tag, Comment
+from albumy.profiling import QueryBudgetExceeded
+from albumy.timeline import push_photo
+from tests.base import BaseTestCase
+
+
+class QueryCountTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(QueryCountTestCase, self).setUp()
+        self.authors = 0
+
+    def add_authors(self, count):
+        normal_user = User.query.filter_by(username='normal').first()
+        for i in range(count):
+            self.authors += 1
+            author = User(email='author%d@helloflask.com' % self.authors, name='Author', username='author%d' % self.authors, confirmed=True)
+            author.set_password('123')
+            db.session.add(author)
+            db.session.commit()
+            author.set_role()
+            normal_user.follow(author)
+            photo = Photo(filename='%d.jpg' % self.authors, filename_s='%d_s.jpg' % self.authors,
+                          filename_m='%d_m.jpg' % self.authors, description='Photo', author=author, flag=1)
+            photo.tags = [Tag(name='tag%d' % self.authors), Tag(name='extra%d' % self.authors)]
+            db.session.add(photo)
+            db.session.flush()
+            push_photo(photo)
+            comment = Comment(body='Comment', author=author, photo=photo, flag=1)
+            db.session.add(comment)
+            db.session.add(Comment(body='Reply', author=normal_user, photo=photo, replied=comment))
+            db.session.commit()
+            normal_user.collect(photo)
+
+    def count_queries(self, url):
+        queries = []
+
+        def record_query(connection, cursor, statement, parameters, context, executemany):
+            queries.append(statement)
+
+        db.session.remove()
+        db.event.listen(db.engine, 'before_cursor_execute', record_query)
+        try:
+            response = self.client.get(url)
+        finally:
+            db.event.remove(db.engine, 'before_cursor_execute', record_query)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertConstantQueries(self, url, limit):
+        self.add_authors(2)
+        count = self.count_queries(url)
+        self.add_authors(5)
+        self.assertEqual(self.count_queries(url), count)
+        self.assertLessEqual(count, limit)
+
+    def test_can_uses_cached_permissions(self):
+        user = User.query.filter_by(username='normal').first()
+        user.can('UPLOAD')
+        queries = []
+
+        def record_query(connection, cursor, statement, parameters, context, executemany):
+            queries.append(statement)
+
+        db.event.listen(db.engine, 'before_cursor_execute', record_query)
+        try:
+            self.assertTrue(user.can('UPLOAD'))
+            self.assertFalse(user.can('MODERATE'))
+            self.assertFalse(user.can('ADMINISTER'))
+        finally:
+            db.event.remove(db.engine, 'before_cursor_execute', record_query)
+        self.assertEqual(queries, [])
+
+    def test_index_queries(self):
+        self.login()
+        self.assertConstantQueries(url_for('main.index'), 8)
+
+    def test_manage_pages_queries(self):
+        self.login(email='admin@helloflask.com', password='123')
+        for endpoint in ('admin.index', 'admin.manage_user', 'admin.manage_photo', 'admin.manage_tag', 'admin.manage_comment'):
+            self.assertConstantQueries(url_for(endpoint), 10)
+
+    def test_public_pages_queries(self):
+        self.login()
+        self.add_authors(1)
+        photo = Photo.query.first()
+        tag = Tag.query.first()
+        urls = [url_for('main.explore'), url_for('main.show_photo', photo_id=photo.id),
+                url_for('main.show_collectors', photo_id=photo.id), url_for('main.show_tag', tag_id=tag.id),
+                url_for('user.index', username='normal'), url_for('user.show_collections', username='normal'),
+                url_for('user.show_followers', username='author1'), url_for('user.show_following', username='normal')]
+        for url in urls:
+            self.assertLessEqual(self.count_queries(url), self.app.config['ALBUMY_QUERY_BUDGET'])
+
+    def add_comments(self, photo_id, count):
+        for i in range(count):
+            self.authors += 1
+            commenter = User(email='author%d@helloflask.com' % self.authors, name='Commenter', username='author%d' % self.authors)
+            db.session.add(Comment(body='Comment', author=commenter, photo_id=photo_id))
+        db.session.commit()
+
+    def test_photo_page_queries(self):
+        self.login()
+        self.add_authors(1)
+        photo_id = Photo.query.first().id
+        self.add_comments(photo_id, 2)
+        count = self.count_queries(url_for('main.show_photo', photo_id=photo_id))
+        self.add_comments(photo_id, 5)
+        self.assertEqual(self.count_queries(url_for('main.show_photo', photo_id=photo_id)), count)
+
+    def test_query_budget(self):
+        self.login()
+        self.add_authors(1)
+        self.app.config['ALBUMY_QUERY_BUDGET'] = 1
+        with self.assertRaises(QueryBudgetExceeded):
+            self.client.get(url_for('main.index'))
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from flask import url_for
+
+from tests.base import BaseTestCase
+
+
+class SearchTestCase(BaseTestCase):
+
+    def test_search_user(self):
+        response = self.client.get(url_for('main.search', q='normal', category='user'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Normal User', response.get_data(as_text=True))
+
+    def test_search_invalid_page(self):
+        for page in (0, -1):
+            for category in ('photo', 'user', 'tag'):
+                response = self.client.get(url_for('main.search', q='normal', category=category, page=page))
+                self.assertEqual(response.status_code, 404)
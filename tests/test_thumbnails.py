@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+import os
+
+from PIL import Image
+from flask import url_for
+
+from albumy.utils import supported_image_formats
+from tests.base import BaseTestCase
+
+
+class ThumbnailTestCase(BaseTestCase):
+
+    def setUp(self):
+        super(ThumbnailTestCase, self).setUp()
+        Image.new('RGB', (1600, 1200)).save(os.path.join(self.upload_path, 'photo.jpg'))
+
+    def test_thumbnail(self):
+        response = self.client.get(url_for('main.get_thumbnail', width=400, filename='photo.jpg'))
+        self.assertEqual(response.mimetype, 'image/jpeg')
+        with Image.open(os.path.join(self.app.config['ALBUMY_THUMBNAIL_PATH'], '400', 'photo.jpg')) as img:
+            self.assertEqual(img.size[0], 400)
+
+    def test_thumbnail_variants(self):
+        for ext, quality in supported_image_formats():
+            response = self.client.get(url_for('main.get_thumbnail', width=400, filename='photo.jpg'),
+                                       headers={'Accept': 'image/%s,image/*' % ext})
+            self.assertEqual(response.mimetype, 'image/' + ext)
+            self.assertIn('Accept', response.vary)
+            with Image.open(os.path.join(self.app.config['ALBUMY_THUMBNAIL_PATH'], '400', 'photo.' + ext)) as img:
+                self.assertEqual(img.size[0], 400)
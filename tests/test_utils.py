@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+import os
+
+from PIL import Image
+
+from albumy.utils import resize_images
+from tests.base import BaseTestCase
+
+
+class UtilsTestCase(BaseTestCase):
+
+    def save_image(self, filename, mode, size=(3400, 2000)):
+        Image.new(mode, size).save(os.path.join(self.upload_path, filename))
+        return os.path.join(self.upload_path, filename)
+
+    def test_resize_images(self):
+        path = self.save_image('photo.jpg', 'RGB')
+        filenames = resize_images(path, 'photo.jpg', [400, 800])
+        self.assertEqual(filenames, ['photo_s.jpg', 'photo_m.jpg'])
+        with Image.open(os.path.join(self.upload_path, 'photo_s.jpg')) as img:
+            self.assertEqual(img.size[0], 400)
+
+    def test_resize_palette_images(self):
+        for filename, mode in (('palette.png', 'P'), ('bilevel.png', '1'), ('animation.gif', 'RGB')):
+            path = self.save_image(filename, mode)
+            name, ext = os.path.splitext(filename)
+            filenames = resize_images(path, filename, [400, 800])
+            self.assertEqual(filenames, [name + '_s' + ext, name + '_m' + ext])
+            with Image.open(os.path.join(self.upload_path, name + '_m' + ext)) as img:
+                self.assertEqual(img.size[0], 800)